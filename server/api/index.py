@@ -1,10 +1,24 @@
 import logging
-from flask import Flask, request, jsonify, send_file, render_template
+from flask import Flask, request, jsonify, send_file, render_template, Response, stream_with_context, g
 import re
 import os
+import json
+import itertools
+from contextlib import closing
 from flask_cors import CORS # Импортируем CORS
-from parser_logic import parse_product, parse_catalog
-from archiver import create_zip_archive
+from parser_logic import parse_product, parse_catalog, iter_catalog, parse_products
+from archiver import create_zip_archive, stream_zip_archive
+from incremental import parse_catalog_incremental
+import jobs
+import metrics
+import price_history
+import records
+import result_cache
+import sites
+from image_processing import normalize_options
+
+# Ограничение на размер одного пакетного запроса /parse_products
+MAX_BATCH_URLS = 500
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -12,6 +26,72 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*", "methods": "*"}}) # Инициализируем CORS для вашего Flask-приложения
 
+@app.before_request
+def start_request_timings():
+    # Разбивка времени запроса по этапам: fetch, parse, extract, image_download, zip_write
+    g.timings, g.timings_token = metrics.start_request()
+
+@app.after_request
+def add_server_timing(response):
+    timings = g.get('timings')
+    # Для потоковых ответов этапы еще не выполнены; send_file отдает уже готовый файл
+    if timings is not None and (not response.is_streamed or response.direct_passthrough):
+        server_timing = timings.server_timing()
+        if server_timing: response.headers['Server-Timing'] = server_timing
+    return response
+
+@app.teardown_request
+def end_request_timings(exc):
+    token = g.pop('timings_token', None)
+    if token is None: return
+    try:
+        metrics.end_request(token)
+    except ValueError:
+        pass # Потоковый ответ завершился уже в другом контексте
+
+def with_timings(payload, data):
+    """Adds the per-stage breakdown to the JSON response when the client asked
+    for it with "timings": true in the body or ?timings=1.
+    """
+    if (data or {}).get('timings') or request.args.get('timings') in ('1', 'true'):
+        payload["timings"] = g.timings.as_dict()
+    return payload
+
+def export_products(products, data, download_name, total_items=None):
+    """Returns the products as a CSV/Parquet/Arrow file when data["format"]
+    asks for one, or None for the usual JSON response.
+    """
+    export_format = (data.get('format') or 'json').lower()
+    if export_format == 'json': return None
+    body, content_type, extension = records.export(records.from_products(products), export_format)
+    headers = {"Content-Disposition": f"attachment; filename={download_name}.{extension}"}
+    if total_items is not None: headers["X-Total-Items"] = str(total_items)
+    return Response(body, content_type=content_type, headers=headers)
+
+def compact_products(products, data):
+    # "compact": true — цены и год целыми числами, как в выгрузках
+    if not data.get('compact'): return products
+    return [record.as_dict() for record in records.from_products(products)]
+
+def parse_catalog_cached(url, show_all=False):
+    # Одновременные запросы одного каталога ждут общий обход, повторные в течение TTL отдаются из кэша
+    def compute():
+        products, total_items = parse_catalog(url, show_all=show_all)
+        price_history.record(products)
+        return [products, total_items] if products else None
+    return result_cache.get_or_compute(result_cache.make_key('catalog', url, show_all=show_all), compute) or ([], 0)
+
+def parse_product_cached(url):
+    def compute():
+        product_details = parse_product(url)
+        if product_details: price_history.record([product_details])
+        return product_details
+    return result_cache.get_or_compute(result_cache.make_key('product', url), compute)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/test')
 def test_page():
     logging.info("Запрос на страницу теста")
@@ -55,33 +135,145 @@ def parse_url():
         logging.warning(f"Получен неверный URL: {url}")
         return jsonify({"error": "Неверный URL. Поддерживаются только rollingmoto.ru и motoland-shop.ru"}), 400
 
+    # Необязательная выгрузка: "format": "csv" | "parquet" | "arrow" (по умолчанию JSON)
+    export_format = (data.get('format') or 'json').lower()
+    if export_format != 'json' and export_format not in records.EXPORT_FORMATS:
+        logging.warning(f"Неподдерживаемый формат выгрузки: {export_format}")
+        return jsonify({"error": f"Неподдерживаемый формат выгрузки: {export_format}"}), 400
+    if export_format in ('parquet', 'arrow') and not records.ARROW_AVAILABLE:
+        logging.warning(f"Выгрузка в {export_format} недоступна: не установлен pyarrow")
+        return jsonify({"error": f"Выгрузка в {export_format} недоступна на этом сервере"}), 400
+
     # Determine if it's a product page or a catalog page
-    is_rollingmoto_product = "rollingmoto.ru" in url and ("/product/" in url or "/moto/" in url)
-    # Для Motoland, URL товара обычно имеет "/catalog/" и затем глубокий путь с несколькими сегментами
-    # Например: /catalog/mototekhnika/mototsikly_1/enduro_1/mototsikl_motoland_250_enduro_gs_172fmm_5_pr250_/
-    # Я буду искать как минимум 4 сегмента после "/catalog/"
-    path_only_url = url.split('?')[0].split('#')[0] # Удаляем параметры запроса и хеш
-    is_motoland_product = "motoland-shop.ru" in url and re.search(r"/catalog(?:/[^/]+){4,}/?$", path_only_url)
-
-    if is_rollingmoto_product or is_motoland_product:
+    # Шаблон URL товара задан для каждого сайта в sites.py
+    site = sites.get_site(url)
+    if site is not None and site.is_product_url(url):
         logging.info(f"Определение типа страницы: товар. URL: {url}")
-        product_details = parse_product(url)
+        product_details = parse_product_cached(url)
         if product_details:
             logging.info(f"Успешно спарсен товар: {url}")
-            return jsonify({"type": "product", "details": product_details})
+            exported = export_products([product_details], data, "product")
+            if exported is not None: return exported
+            return jsonify(with_timings({"type": "product", "details": compact_products([product_details], data)[0]}, data))
         else:
             logging.error(f"Ошибка парсинга страницы товара: {url}")
             return jsonify({"error": "Ошибка парсинга страницы товара"}), 500
     else:
         logging.info(f"Определение типа страницы: каталог. URL: {url}")
-        products, total_items = parse_catalog(url)
+        if data.get('incremental'):
+            # Повторный обход: отдаем только добавленные, удаленные и изменившиеся товары
+            diff = parse_catalog_incremental(url)
+            if diff is None:
+                logging.error(f"Ошибка инкрементального обхода каталога: {url}")
+                return jsonify({"error": "Ошибка парсинга каталога или товары не найдены"}), 500
+            logging.info(f"Инкрементальный обход каталога: {url}, новых: {len(diff['added'])}, "
+                         f"удаленных: {len(diff['removed'])}, изменившихся: {len(diff['changed'])}")
+            return jsonify(with_timings({"type": "catalog_diff", **diff}, data))
+        # "show_all": true — просить весь каталог одной страницей (SHOWALL_1), если сайт это разрешает
+        products, total_items = parse_catalog_cached(url, show_all=bool(data.get('show_all')))
         if products:
             logging.info(f"Успешно спарсен каталог: {url}, найдено товаров: {total_items}")
-            return jsonify({"type": "catalog", "products": products, "totalItems": total_items})
+            exported = export_products(products, data, "catalog", total_items)
+            if exported is not None: return exported
+            return jsonify(with_timings({"type": "catalog", "products": compact_products(products, data), "totalItems": total_items}, data))
         else:
             logging.error(f"Ошибка парсинга каталога или товары не найдены: {url}")
             return jsonify({"error": "Ошибка парсинга каталога или товары не найдены"}), 500
 
+@app.route('/parse_catalog_stream', methods=['GET', 'POST'])
+def parse_catalog_stream():
+    # Каталог отдается по мере парсинга страниц: NDJSON (по умолчанию) или Server-Sent Events
+    logging.info("Получен запрос на потоковый парсинг каталога")
+    data = request.get_json(silent=True) or request.args
+    url = data.get('url')
+    output_format = data.get('format', 'ndjson')
+    show_all = data.get('show_all') in (True, '1', 'true')
+
+    if not url:
+        logging.warning("URL не предоставлен в запросе на потоковый парсинг")
+        return jsonify({"error": "URL is required"}), 400
+
+    if not re.match(r"^https?://(www\.rollingmoto\.ru/|motoland-shop\.ru/)", url):
+        logging.warning(f"Получен неверный URL: {url}")
+        return jsonify({"error": "Неверный URL. Поддерживаются только rollingmoto.ru и motoland-shop.ru"}), 400
+
+    def encode(event, payload):
+        body = json.dumps(payload, ensure_ascii=False)
+        if output_format == 'sse':
+            return f"event: {event}\ndata: {body}\n\n"
+        return body + "\n"
+
+    # Первую страницу загружаем до начала ответа: если она не загрузилась, клиент
+    # получает ту же ошибку, что и от /parse_url, а не пустой каталог
+    batches = iter_catalog(url, show_all=show_all)
+    first_batch = next(batches, None)
+    if first_batch is None:
+        logging.error(f"Ошибка парсинга каталога или товары не найдены: {url}")
+        return jsonify({"error": "Ошибка парсинга каталога или товары не найдены"}), 500
+
+    def generate():
+        products_count = 0
+        total_items = 0
+        with closing(batches):
+            for batch in itertools.chain([first_batch], batches):
+                products_count += len(batch["products"])
+                total_items = batch["totalItems"]
+                price_history.record(batch["products"])
+                yield encode("page", {"type": "page", **batch})
+        logging.info(f"Потоковый парсинг каталога завершен: {url}, отдано товаров: {products_count}")
+        yield encode("done", {"type": "done", "totalItems": total_items, "productsCount": products_count})
+
+    mimetype = 'text/event-stream' if output_format == 'sse' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/parse_products', methods=['POST'])
+def parse_products_batch():
+    # Пакетное обогащение: характеристики и полные галереи для списка товаров за один запрос
+    logging.info("Получен запрос на пакетный парсинг товаров")
+    data = request.get_json()
+    urls = data.get('urls') or []
+    total_items = None
+    truncated = False
+
+    if data.get('enrich') and data.get('url'):
+        url = data['url']
+        if not re.match(r"^https?://(www\.rollingmoto\.ru/|motoland-shop\.ru/)", url):
+            logging.warning(f"Получен неверный URL: {url}")
+            return jsonify({"error": "Неверный URL. Поддерживаются только rollingmoto.ru и motoland-shop.ru"}), 400
+        # Обходим каталог только до первых MAX_BATCH_URLS товаров: остальные страницы не загружаем
+        urls = []
+        with closing(iter_catalog(url)) as batches:
+            for batch in batches:
+                total_items = batch["totalItems"]
+                urls.extend(product['link'] for product in batch["products"])
+                if len(urls) >= MAX_BATCH_URLS: break
+        if not urls:
+            logging.error(f"Ошибка парсинга каталога или товары не найдены: {url}")
+            return jsonify({"error": "Ошибка парсинга каталога или товары не найдены"}), 500
+        truncated = len(urls) > MAX_BATCH_URLS or total_items > MAX_BATCH_URLS
+        urls = urls[:MAX_BATCH_URLS]
+
+    if not urls or not isinstance(urls, list):
+        logging.warning("Список URL товаров не предоставлен")
+        return jsonify({"error": "Нужен список urls или url каталога с enrich"}), 400
+    if len(urls) > MAX_BATCH_URLS:
+        logging.warning(f"Слишком много URL в пакетном запросе: {len(urls)}")
+        return jsonify({"error": f"Не больше {MAX_BATCH_URLS} URL за один запрос"}), 400
+    for url in urls:
+        if not isinstance(url, str) or not re.match(r"^https?://(www\.rollingmoto\.ru/|motoland-shop\.ru/)", url):
+            logging.warning(f"Получен неверный URL в пакетном запросе: {url!r}")
+            return jsonify({"error": "Неверный URL. Поддерживаются только rollingmoto.ru и motoland-shop.ru"}), 400
+
+    results = parse_products(urls)
+    price_history.record([result["details"] for result in results.values() if "details" in result])
+    errors = sum(1 for result in results.values() if 'error' in result)
+    logging.info(f"Пакетный парсинг завершен: товаров {len(results)}, ошибок {errors}")
+    response = {"type": "products", "results": results, "errors": errors}
+    if total_items is not None:
+        response["totalItems"] = total_items
+        response["truncated"] = truncated
+    return jsonify(with_timings(response, data))
+
 @app.route('/download_archive', methods=['POST'])
 def download_archive():
     logging.info("Получен запрос на скачивание архива")
@@ -93,9 +285,25 @@ def download_archive():
         logging.warning("Список товаров для архива не предоставлен")
         return jsonify({"error": "Список товаров для архива обязателен"}), 400
 
+    try:
+        # Необязательная обработка: {"max_width", "max_height", "format": "webp"|"jpeg", "quality"}
+        processing = normalize_options(data.get('processing'))
+    except ValueError as e:
+        logging.warning(f"Неверные параметры обработки изображений: {e}")
+        return jsonify({"error": str(e)}), 400
+
+    if data.get('stream'):
+        # Архив собирается на лету: изображения пишутся в ZIP прямо из сети, без временной папки
+        logging.info(f"Потоковая отдача архива, товаров: {len(products_data)}")
+        return Response(
+            stream_with_context(stream_zip_archive(products_data, processing=processing)),
+            mimetype='application/zip',
+            headers={"Content-Disposition": "attachment; filename=product_images.zip"},
+        )
+
     archive_path = None # Инициализируем archive_path
     try:
-        archive_path = create_zip_archive(products_data)
+        archive_path = create_zip_archive(products_data, processing=processing)
         logging.info(f"Архив успешно создан: {archive_path}")
         # Отправляем файл клиенту
         response = send_file(archive_path, as_attachment=True, download_name="product_images.zip")
@@ -115,5 +323,99 @@ def download_archive():
                 logging.error(f"Ошибка при удалении временного архива: {e}", exc_info=True)
                 print(f"Ошибка при удалении временного архива: {e}")
 
+@app.route('/price_changes', methods=['GET'])
+def price_changes():
+    # Изменения цен после момента since (unix-время или ISO 8601) по сохраненной истории, без обхода сайтов
+    since = request.args.get('since')
+    if not since:
+        return jsonify({"error": "Параметр since обязателен"}), 400
+    try:
+        since = price_history.parse_since(since)
+        limit = int(request.args.get('limit', price_history.DEFAULT_CHANGES_LIMIT))
+    except ValueError:
+        logging.warning(f"Неверные параметры запроса изменений цен: {dict(request.args)}")
+        return jsonify({"error": "Неверное значение since или limit"}), 400
+    changes = price_history.changes_since(since, site=request.args.get('site'),
+                                          include_new=request.args.get('include_new') in ('1', 'true'), limit=limit)
+    return jsonify({"since": since, "changes": changes})
+
+@app.route('/price_history', methods=['GET'])
+def product_price_history():
+    link = request.args.get('link')
+    if not link:
+        return jsonify({"error": "Параметр link обязателен"}), 400
+    product_history = price_history.history(link)
+    if product_history is None:
+        return jsonify({"error": "Товар еще не встречался в разобранных каталогах"}), 404
+    return jsonify(product_history)
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    # Долгие операции ставятся в фоновую очередь; клиент опрашивает статус по job_id
+    logging.info("Получен запрос на создание фоновой задачи")
+    data = request.get_json()
+    kind = data.get('type')
+
+    if kind == 'parse_catalog':
+        url = data.get('url')
+        if not url or not re.match(r"^https?://(www\.rollingmoto\.ru/|motoland-shop\.ru/)", url):
+            logging.warning(f"Получен неверный URL для фоновой задачи: {url}")
+            return jsonify({"error": "Неверный URL. Поддерживаются только rollingmoto.ru и motoland-shop.ru"}), 400
+        payload = {"url": url, "show_all": bool(data.get('show_all'))}
+    elif kind == 'archive':
+        if not data.get('products_data'):
+            logging.warning("Список товаров для архива не предоставлен")
+            return jsonify({"error": "Список товаров для архива обязателен"}), 400
+        try:
+            processing = normalize_options(data.get('processing'))
+        except ValueError as e:
+            logging.warning(f"Неверные параметры обработки изображений: {e}")
+            return jsonify({"error": str(e)}), 400
+        payload = {"products_data": data['products_data'], "processing": processing}
+    elif kind == 'crawl':
+        # Обход многих каталогов: seeds — список разделов, discover — корни, с которых разделы ищутся по ссылкам
+        seeds = data.get('seeds') or []
+        discover = data.get('discover') or []
+        if not isinstance(seeds, list) or not isinstance(discover, list) or not (seeds or discover or data.get('crawl_id')):
+            logging.warning("Не заданы каталоги для обхода")
+            return jsonify({"error": "Нужен список seeds, discover или crawl_id для возобновления"}), 400
+        for url in seeds + discover:
+            if not isinstance(url, str) or not re.match(r"^https?://(www\.rollingmoto\.ru/|motoland-shop\.ru/)", url):
+                logging.warning(f"Получен неверный URL для обхода: {url}")
+                return jsonify({"error": "Неверный URL. Поддерживаются только rollingmoto.ru и motoland-shop.ru"}), 400
+        payload = {"seeds": seeds, "discover": discover, "crawl_id": data.get('crawl_id')}
+    else:
+        logging.warning(f"Неизвестный тип фоновой задачи: {kind}")
+        return jsonify({"error": "Тип задачи должен быть parse_catalog, archive или crawl"}), 400
+
+    job_id = jobs.submit(kind, payload)
+    logging.info(f"Фоновая задача {kind} создана: {job_id}")
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Задача не найдена"}), 404
+    return jsonify({key: job[key] for key in ("id", "kind", "status", "progress", "error", "created_at", "updated_at")})
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Задача не найдена"}), 404
+    if job['status'] != 'done':
+        return jsonify({"error": "Задача еще не завершена", "status": job['status']}), 409
+
+    if job['kind'] == 'archive':
+        archive_path = job['result']['archive_path']
+        if not os.path.exists(archive_path):
+            logging.error(f"Архив фоновой задачи не найден: {archive_path}")
+            return jsonify({"error": "Архив больше недоступен"}), 410
+        return send_file(archive_path, as_attachment=True, download_name="product_images.zip")
+    if job['kind'] == 'crawl':
+        return jsonify({"type": "crawl", **job['result']})
+    return jsonify({"type": "catalog", **job['result']})
+
 if __name__ == '__main__':
     app.run(debug=False) 
\ No newline at end of file
@@ -1,51 +1,170 @@
 import requests
+import io
 import zipfile
 import tempfile
 import shutil
 import os
 import re
-from PIL import Image
-from io import BytesIO
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+import http_client
+import image_store
+import image_processing
+import metrics
+import sites
+import hashlib
+import json
 
-def download_image(url, destination_path):
-    try:
-        img_data = requests.get(url, timeout=10).content
-        if not img_data: return False
-
-        ext = os.path.splitext(url)[1].lower()
-        if not ext or len(ext) > 5 or '.' not in ext:
-            try:
-                img = Image.open(BytesIO(img_data))
-                img_format = img.format.lower()
-                ext = f".{img_format if img_format != 'jpeg' else 'jpg'}"
-                img.close()
-            except Exception:
-                ext = ".jpg"
-
-        filename = os.path.basename(url)
-        if '.' not in filename:
-             filename += ext
-        else:
-             original_ext_in_url = os.path.splitext(os.path.basename(url))[1].lower()
-             if original_ext_in_url and original_ext_in_url not in ['.png', '.jpg', '.jpeg', '.bmp', '.gif', '.bin']:
-                 filename = os.path.splitext(filename)[0] + ext
+# Параллельная загрузка изображений для архива
+DEFAULT_DOWNLOAD_WORKERS = 8
+DEFAULT_PER_HOST_LIMIT = 4 # Не больше стольких одновременных запросов к одному хосту
+DEFAULT_ARCHIVE_DEADLINE = 120 # Секунд на загрузку всех изображений одного архива
+
+# Уже сжатые форматы кладем в архив без повторного сжатия
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif'}
+STREAM_CHUNK_SIZE = 64 * 1024
+# Файл в корне архива: какие изображения не добавлены повторно и где лежит их копия
+DUPLICATES_MANIFEST = "duplicates.json"
+
+def _image_filename(url, img_data):
+    """Builds a safe file name for the image. img_data may be only the first
+    chunk of the body: only its header is used to sniff the format.
+    """
+    ext = os.path.splitext(url)[1].lower()
+    if not ext or len(ext) > 5 or '.' not in ext:
+        # Формат определяем по сигнатуре в заголовке файла, не декодируя изображение
+        ext = image_processing.sniff_image_format(img_data) or ".jpg"
+
+    filename = os.path.basename(url)
+    if '.' not in filename:
+         filename += ext
+    else:
+         original_ext_in_url = os.path.splitext(os.path.basename(url))[1].lower()
+         if original_ext_in_url and original_ext_in_url not in ['.png', '.jpg', '.jpeg', '.bmp', '.gif', '.bin']:
+             filename = os.path.splitext(filename)[0] + ext
+
+    img_filename = re.sub(r'[\\/:*?"<>|]', '_', filename)
+    img_filename = re.sub(r'[\\s]+', '_', img_filename).strip()
+    if not img_filename or img_filename == '.': img_filename = f"img_{len(img_data)}.jpg" # Fallback filename
+    return img_filename
+
+def _folder_name(product):
+    # Улучшенная очистка имени папки от недопустимых символов
+    folder_name = product.get('name', 'Без названия')
+    folder_name = re.sub(r'[\\/:*?"<>|]', '_', folder_name)
+    folder_name = re.sub(r'[\\s]+', ' ', folder_name).strip()
+    folder_name = folder_name[:200] # Обрезаем длинные имена
+    if not folder_name or folder_name == '_': folder_name = "Без названия"
+    return folder_name
+
+def _compress_type(filename):
+    if os.path.splitext(filename)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+class _Cutoff:
+    """Closes the folders of one archive to the downloads that are still
+    running when its deadline expires.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.closed = False
 
-        img_filename = re.sub(r'[\\/:*?"<>|]', '_', filename)
-        img_filename = re.sub(r'[\\s]+', '_', img_filename).strip()
-        if not img_filename or img_filename == '.': img_filename = f"img_{len(img_data)}.jpg" # Fallback filename
+    def close(self):
+        with self.lock:
+            self.closed = True
 
+def download_image(url, destination_path, cutoff=None):
+    try:
+        # Изображение берется из локального хранилища, из сети — только если его там нет
+        with metrics.stage('image_download'):
+            stored = image_store.fetch(url, timeout=10)
+        if not stored: return False
+        _, blob_path = stored
+        with open(blob_path, "rb") as f:
+            header = f.read(STREAM_CHUNK_SIZE)
+
+        img_filename = _image_filename(url, header)
         final_path = os.path.join(destination_path, img_filename)
-        with open(final_path, "wb") as f:
-            f.write(img_data)
+        # Пишем во временный файл и переименовываем, чтобы архив не захватил недописанное изображение
+        partial_path = final_path + ".part"
+        if cutoff is not None and cutoff.closed: return False
+        if os.path.exists(partial_path): os.remove(partial_path)
+        try:
+            os.link(blob_path, partial_path) # Жесткая ссылка: без копирования байтов
+        except OSError:
+            shutil.copyfile(blob_path, partial_path)
+        if cutoff is None:
+            os.replace(partial_path, final_path)
+            return True
+        with cutoff.lock:
+            # После срока архив уже собирается из папки (или она удалена): файл туда не кладем
+            if cutoff.closed:
+                os.remove(partial_path)
+                return False
+            os.replace(partial_path, final_path)
         return True
+    except image_store.ImageRejected as e:
+        print(f"Изображение {url} пропущено: {e}")
+        return False
     except requests.exceptions.RequestException as e:
         print(f"Ошибка сети при скачивании изображения {url}: {e}")
+        metrics.count('errors_total', site=sites.site_name(url), stage='image_download')
         return False
     except Exception as e:
         print(f"Ошибка скачивания изображения {url}: {e}")
+        metrics.count('errors_total', site=sites.site_name(url), stage='image_download')
         return False
 
-def create_zip_archive(product_data_list):
+def _download_images(downloads, max_workers, per_host_limit, deadline, progress=None):
+    """Downloads (url, destination_path) pairs in parallel. Images that are not
+    finished when the deadline expires are left out of the archive.
+    progress(done, total) is called after every finished download.
+    """
+    if not downloads: return
+    host_limits = {urlsplit(url).netloc: threading.BoundedSemaphore(per_host_limit) for url, _ in downloads}
+    deadline_at = time.monotonic() + deadline
+    cutoff = _Cutoff()
+
+    @metrics.bind
+    def download(url, destination_path):
+        with host_limits[urlsplit(url).netloc]:
+            if time.monotonic() >= deadline_at: return False
+            return download_image(url, destination_path, cutoff)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(downloads))))
+    try:
+        futures = [executor.submit(download, url, destination_path) for url, destination_path in downloads]
+        if progress is not None:
+            done_lock = threading.Lock()
+            done_count = [0]
+            def on_done(_):
+                with done_lock:
+                    done_count[0] += 1
+                    progress(done_count[0], len(futures))
+            for future in futures:
+                future.add_done_callback(on_done)
+        _, not_done = wait(futures, timeout=deadline)
+        if not_done:
+            print(f"Превышено время сборки архива ({deadline} с), не загружено изображений: {len(not_done)}")
+    finally:
+        # Не ждем зависшие загрузки: после close() они не добавят в папки архива ни одного файла
+        cutoff.close()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def _file_sha256(path):
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def create_zip_archive(product_data_list, max_workers=DEFAULT_DOWNLOAD_WORKERS,
+                       per_host_limit=DEFAULT_PER_HOST_LIMIT, deadline=DEFAULT_ARCHIVE_DEADLINE,
+                       progress=None, dedupe=True, processing=None):
     temp_dir = None
     archive_name = "product_images.zip"
     try:
@@ -53,29 +172,51 @@ def create_zip_archive(product_data_list):
         if not os.path.exists(temp_dir):
              raise Exception("Не удалось создать временную директорию.")
 
+        downloads = []
         for product in product_data_list:
-            # Улучшенная очистка имени папки от недопустимых символов
-            folder_name = product.get('name', 'Без названия')
-            folder_name = re.sub(r'[\\/:*?"<>|]', '_', folder_name)
-            folder_name = re.sub(r'[\\s]+', ' ', folder_name).strip()
-            folder_name = folder_name[:200] # Обрезаем длинные имена
-            if not folder_name or folder_name == '_': folder_name = "Без названия"
-            product_dir = os.path.join(temp_dir, folder_name)
+            product_dir = os.path.join(temp_dir, _folder_name(product))
             os.makedirs(product_dir, exist_ok=True)
 
             for img_url in product.get("images", []):
-                download_image(img_url, product_dir)
+                downloads.append((img_url, product_dir))
+
+        _download_images(downloads, max_workers, per_host_limit, deadline, progress)
+
+        if processing:
+            # Уменьшение и перекодирование идут в пуле процессов, файлы заменяются результатом
+            image_paths = [os.path.join(root, file) for root, dirs, files in os.walk(temp_dir)
+                           for file in files if not file.endswith(".part")]
+            image_processing.process_files(image_paths, processing)
 
         # Путь для сохранения архива, который Flask затем отправит
         # Мы не знаем путь сохранения на стороне клиента, поэтому создаем временный архив
         archive_path = os.path.join(temp_dir, archive_name) 
 
-        with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(temp_dir):
+        with metrics.stage('zip_write'), zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+            archived = {} # sha256 -> имя в архиве: одинаковое изображение кладем в архив один раз
+            duplicates = {}
+            # Файлы обходим в порядке товаров и их изображений, а не в порядке os.walk:
+            # копию изображения получает первый товар, который на него ссылается
+            url_stems = {}
+            for img_url, product_dir in downloads:
+                url_stems.setdefault(product_dir, []).append(os.path.splitext(_image_filename(img_url, b''))[0])
+            for product_dir, stems in url_stems.items():
+                order = {stem: i for i, stem in reversed(list(enumerate(stems)))}
+                files = sorted(os.listdir(product_dir), key=lambda file: (order.get(os.path.splitext(file)[0], len(stems)), file))
                 for file in files:
-                    file_path = os.path.join(root, file)
+                    if file.endswith(".part"): continue
+                    file_path = os.path.join(product_dir, file)
                     arcname = os.path.relpath(file_path, temp_dir)
-                    zipf.write(file_path, arcname)
+                    if dedupe:
+                        file_hash = _file_sha256(file_path)
+                        if file_hash in archived:
+                            duplicates[arcname] = archived[file_hash]
+                            continue
+                        archived[file_hash] = arcname
+                    zipf.write(file_path, arcname, compress_type=_compress_type(file))
+            if duplicates:
+                # Чтобы папки товаров оставались понятными, перечисляем пропущенные копии
+                zipf.writestr(DUPLICATES_MANIFEST, json.dumps(duplicates, ensure_ascii=False, indent=2))
 
         # Возвращаем путь к архиву. app.py будет отвечать за его отправку и удаление
         return archive_path
@@ -85,4 +226,130 @@ def create_zip_archive(product_data_list):
         # В случае ошибки, очистим временную директорию
         if temp_dir and os.path.exists(temp_dir):
             shutil.rmtree(temp_dir, ignore_errors=True)
-        raise # Перевыбрасываем исключение, чтобы Flask мог его обработать 
\ No newline at end of file
+        raise # Перевыбрасываем исключение, чтобы Flask мог его обработать 
+
+class _StreamBuffer(io.RawIOBase):
+    """Unseekable sink for ZipFile: collects written bytes until they are sent."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _iter_file(path):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b''):
+            yield chunk
+
+def _tee(chunks, writer):
+    for chunk in chunks:
+        writer.write(chunk)
+        yield chunk
+
+def _stream_entry(zipf, buffer, folder_name, img_url, chunks, written, img_filename=None):
+    """Writes one image into the streamed archive, yielding the produced bytes.
+    Always consumes chunks to the end.
+    """
+    first_chunk = next(chunks, b'')
+    if not first_chunk: return
+
+    img_filename = img_filename or _image_filename(img_url, first_chunk)
+    arcname = f"{folder_name}/{img_filename}"
+    if arcname in written: # Как и во временной папке, одинаковое имя сохраняем один раз
+        for _ in chunks: pass
+        return
+    written.add(arcname)
+
+    zip_info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+    zip_info.compress_type = _compress_type(img_filename)
+    # Загрузка и запись здесь перемежаются, поэтому время записи в ZIP копим по кускам
+    write_seconds = 0.0
+    with zipf.open(zip_info, "w") as entry:
+        start = time.perf_counter()
+        entry.write(first_chunk)
+        write_seconds += time.perf_counter() - start
+        yield buffer.pop()
+        for chunk in chunks:
+            start = time.perf_counter()
+            entry.write(chunk)
+            write_seconds += time.perf_counter() - start
+            yield buffer.pop()
+    metrics.add_stage_time('zip_write', write_seconds)
+
+def _stream_processed_entry(zipf, buffer, folder_name, img_url, written, archived_blobs, dedupe, processing):
+    # Обработке нужно изображение целиком, поэтому сначала оно попадает в хранилище
+    stored = image_store.fetch(img_url, timeout=10)
+    if not stored: return
+    sha256, blob_path = stored
+    if dedupe and sha256 in archived_blobs: return
+    archived_blobs.add(sha256)
+    with open(blob_path, "rb") as f:
+        img_filename = _image_filename(img_url, f.read(STREAM_CHUNK_SIZE))
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        try:
+            processed_path = image_processing.process_file(blob_path, work_dir, img_filename, processing)
+        except Exception as e:
+            print(f"Ошибка обработки изображения {img_url}: {e}")
+            processed_path = blob_path
+        else:
+            img_filename = os.path.basename(processed_path)
+        yield from _stream_entry(zipf, buffer, folder_name, img_url, _iter_file(processed_path), written, img_filename)
+
+def stream_zip_archive(product_data_list, dedupe=True, processing=None):
+    """Yields the ZIP archive chunk by chunk while the images are downloaded,
+    without staging them in a temporary folder. Images already in the image
+    store are read from it; new ones are saved there on the way.
+    """
+    buffer = _StreamBuffer()
+    # Поток не поддерживает seek, поэтому zipfile пишет размеры и CRC в дескрипторы после данных
+    with zipfile.ZipFile(buffer, "w") as zipf:
+        written = set()
+        archived_blobs = set()
+        for product in product_data_list:
+            folder_name = _folder_name(product)
+            for img_url in product.get("images", []):
+                try:
+                    if processing:
+                        yield from _stream_processed_entry(zipf, buffer, folder_name, img_url, written,
+                                                           archived_blobs, dedupe, processing)
+                        continue
+
+                    stored = image_store.lookup(img_url)
+                    if stored is not None:
+                        sha256, blob_path = stored
+                        # Содержимое известно заранее, поэтому одинаковые изображения пропускаем
+                        if dedupe and sha256 in archived_blobs: continue
+                        archived_blobs.add(sha256)
+                        yield from _stream_entry(zipf, buffer, folder_name, img_url, _iter_file(blob_path), written)
+                        continue
+
+                    with http_client.get(img_url, timeout=10, stream=True) as response:
+                        response.raise_for_status()
+                        with image_store.BlobWriter(img_url) as writer:
+                            chunks = _tee(image_store.iter_image_chunks(response), writer)
+                            yield from _stream_entry(zipf, buffer, folder_name, img_url, chunks, written)
+                        metrics.count('http_bytes_total', writer.size, kind='image')
+                        if writer.sha256: archived_blobs.add(writer.sha256)
+                except image_store.ImageRejected as e:
+                    # Тип и размер из заголовков проверяются до записи в архив; обрезанным может
+                    # остаться только изображение без Content-Length, выросшее больше предела
+                    print(f"Изображение {img_url} пропущено: {e}")
+                except requests.exceptions.RequestException as e:
+                    # Если обрыв случился посреди файла, уже отправленная часть останется в архиве
+                    print(f"Ошибка сети при скачивании изображения {img_url}: {e}")
+                    metrics.count('errors_total', site=sites.site_name(img_url), stage='image_download')
+                except Exception as e:
+                    print(f"Ошибка скачивания изображения {img_url}: {e}")
+                    metrics.count('errors_total', site=sites.site_name(img_url), stage='image_download')
+    yield buffer.pop() # Центральный каталог архива
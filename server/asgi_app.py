@@ -0,0 +1,429 @@
+import asyncio
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+import httpx
+import requests
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+import archiver
+import http_cache
+import http_client
+import image_store
+import metrics
+import parse_pool
+import parser_logic
+import price_history
+import records
+import result_cache
+import sites
+import throttle
+from image_processing import normalize_options
+from incremental import parse_catalog_incremental
+
+# Асинхронный вариант /parse_url и /download_archive (ASGI, Starlette + httpx).
+# Сетевые запросы идут из цикла событий и не занимают потоков, поэтому один процесс
+# держит сотни одновременных запросов. В потоки уходят только разбор HTML и работа с диском.
+# Запуск из папки server: uvicorn asgi_app:app --port 5000
+# (разбор в пуле процессов включается через parse_pool.configure(processes=...))
+PARSE_WORKERS = min(32, (os.cpu_count() or 1) + 4) # Потоков для разбора HTML, общих для всех запросов
+CATALOG_PAGE_CONCURRENCY = parser_logic.DEFAULT_PAGE_WORKERS # Страниц одного каталога, загружаемых одновременно
+ARCHIVE_DOWNLOAD_CONCURRENCY = archiver.DEFAULT_DOWNLOAD_WORKERS # Изображений одного архива, загружаемых одновременно
+
+# Ошибки загрузки: httpx для сетевых запросов, requests — для ответов из кэша страниц
+_FETCH_ERRORS = (httpx.HTTPError, requests.exceptions.RequestException)
+# Обрывы соединения и таймауты повторяются, как их повторяет Retry синхронного http_client
+_RETRY_ERRORS = (httpx.NetworkError, httpx.TimeoutException, httpx.RemoteProtocolError)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_client = None
+_parse_pool = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix='parse')
+
+def _get_client():
+    # Клиент привязан к циклу событий, поэтому создается при первом запросе, а не при импорте
+    global _client
+    if _client is None:
+        # Соединений столько же, сколько в пуле синхронного клиента; сверх этого запросы ждут в очереди
+        pool_size = http_client.POOL_CONNECTIONS * http_client.POOL_SIZE
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(http_client.DEFAULT_TIMEOUT, pool=None),
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            headers={'Accept-Encoding': 'gzip, deflate'},
+        )
+    return _client
+
+async def _send(url, headers=None, stream=False):
+    """GET with the retry policy of http_client: connection errors, timeouts,
+    429 and 5xx are repeated with backoff (or after Retry-After). A streamed
+    response must be closed by the caller.
+    """
+    client = _get_client()
+    host = urlsplit(url).hostname
+    attempt = 0
+    while True:
+        try:
+            # Слот и токен хоста из throttle: тот же AIMD-лимит, что у потоковых запросов http_client
+            async with throttle.request_async(host) as outcome:
+                response = await client.send(client.build_request('GET', url, headers=headers), stream=stream)
+                retry_after = http_client.retry_after_seconds(response.headers.get('Retry-After'))
+                outcome.status, outcome.retry_after = response.status_code, retry_after
+        except _RETRY_ERRORS:
+            if attempt >= http_client.MAX_RETRIES: raise
+            await asyncio.sleep(http_client.BACKOFF_FACTOR * 2 ** attempt)
+            attempt += 1
+            continue
+        if response.status_code in throttle.OVERLOAD_STATUSES:
+            throttle.report_overload(host, retry_after)
+        if response.status_code not in http_client.RETRY_STATUSES or attempt >= http_client.MAX_RETRIES:
+            return response
+        await response.aclose()
+        await asyncio.sleep(retry_after or http_client.BACKOFF_FACTOR * 2 ** attempt)
+        attempt += 1
+
+async def _fetch_html(url):
+    # Тот же дисковый кэш страниц, что и у Flask-версии: свежая запись отдается без запроса
+    # Чтение и запись кэша (а при переполнении и обход всей папки) идут в потоке, а не в цикле событий
+    with metrics.stage('fetch'):
+        response, entry = await asyncio.to_thread(http_cache.begin, url)
+        if response is None:
+            response = await asyncio.to_thread(http_cache.finish, entry, await _send(url, headers=entry.headers))
+        response.raise_for_status()
+        return response.text
+
+async def _in_thread(func, *args):
+    # Пул потоков общий для всех запросов; разбивка времени идет в запрос, который вызвал функцию
+    return await asyncio.get_running_loop().run_in_executor(_parse_pool, metrics.bind(func), *args)
+
+async def _parse(func, *args):
+    """Runs the CPU-bound part (HTML parsing) off the event loop: in the parser
+    processes when parse_pool is enabled, otherwise in the thread pool.
+    """
+    if parse_pool.enabled():
+        return await parse_pool.run_async(func, *args)
+    return await _in_thread(func, *args)
+
+async def parse_product(url):
+    adapter = sites.get_site(url)
+    if adapter is None: return {}
+    try:
+        html = await _fetch_html(url)
+    except _FETCH_ERRORS as e:
+        print(f"Ошибка сети или HTTP при загрузке страницы товара {url}: {e}")
+        metrics.count('errors_total', site=adapter.name, stage='product_fetch')
+        return {}
+    return await _parse(parser_logic.parse_product_html, url, html)
+
+async def iter_catalog(url, show_all=False):
+    """Async counterpart of parser_logic.iter_catalog: yields the catalog page
+    by page, with the same stop rules.
+    """
+    first_url = parser_logic.catalog_page_url(url, 1, show_all)
+    adapter = sites.get_site(first_url)
+    if adapter is None: return
+    try:
+        html = await _fetch_html(first_url)
+    except _FETCH_ERRORS as e:
+        print(f"Ошибка сети или HTTP при загрузке первой страницы: {e}")
+        metrics.count('errors_total', site=adapter.name, stage='catalog_fetch')
+        return
+    first_page = await _parse(parser_logic.parse_first_catalog_html, first_url, html,
+                              parser_logic.extract_catalog_products, show_all)
+    if first_page is None: return
+    _, total_items, total_pages, products = first_page
+    yield {"page": 1, "totalPages": total_pages, "totalItems": total_items, "products": products}
+
+    semaphore = asyncio.Semaphore(CATALOG_PAGE_CONCURRENCY)
+    async def load(page_num):
+        page_url = parser_logic.catalog_page_url(url, page_num)
+        async with semaphore:
+            try:
+                page_html = await _fetch_html(page_url)
+            except _FETCH_ERRORS as e:
+                print(f"Ошибка сети или HTTP при загрузке страницы {page_num}: {e}. Пропускаем.")
+                metrics.count('errors_total', site=adapter.name, stage='catalog_fetch')
+                return []
+        return await _parse(parser_logic.parse_catalog_page_html, page_url, page_num, page_html)
+
+    page_nums = range(2, total_pages + 1)
+    tasks = [asyncio.ensure_future(load(page_num)) for page_num in page_nums]
+    try:
+        previous_products = products
+        for page_num, task in zip(page_nums, tasks):
+            page_products = await task
+            if page_products is None:
+                break # Конец каталога: последующие страницы отбрасываем
+            if parser_logic.same_products(page_products, previous_products):
+                print(f"Страница {page_num} повторяет предыдущую. Предполагается конец каталога.")
+                break
+            if page_products: previous_products = page_products
+            yield {"page": page_num, "totalPages": total_pages, "totalItems": total_items, "products": page_products}
+    finally:
+        for task in tasks: task.cancel()
+
+async def parse_catalog(url, show_all=False):
+    products = []
+    total_items = 0
+    async for batch in iter_catalog(url, show_all=show_all):
+        products.extend(batch["products"])
+        total_items = batch["totalItems"]
+    return products, total_items
+
+async def fetch_image(url):
+    """image_store.fetch over the async client: the body goes to the store
+    chunk by chunk with the same type and size checks.
+    """
+    # Хранилище — SQLite с timeout=30 и файлы на диске: все обращения к нему идут в потоке,
+    # чтобы ожидание блокировки базы не останавливало остальные запросы
+    stored = await asyncio.to_thread(image_store.lookup, url)
+    if stored is not None: return stored
+    response = await _send(url, stream=True)
+    try:
+        response.raise_for_status()
+        check = image_store.ImageBodyCheck(response.headers)
+        writer = await asyncio.to_thread(image_store.BlobWriter, url)
+        try:
+            async for chunk in response.aiter_bytes(image_store.DOWNLOAD_CHUNK_SIZE):
+                check.feed(chunk)
+                await asyncio.to_thread(writer.write, chunk)
+        except BaseException as e:
+            await asyncio.to_thread(writer.__exit__, type(e), e, e.__traceback__)
+            raise
+        else:
+            await asyncio.to_thread(writer.__exit__, None, None, None) # Фиксация блоба и вытеснение старых
+        finally:
+            metrics.count('http_bytes_total', writer.size, kind='image')
+    finally:
+        await response.aclose()
+    if writer.sha256 is None: return None
+    return writer.sha256, image_store.blob_path(writer.sha256)
+
+async def _download_images(urls):
+    """Puts every image into the store; returns the URLs that made it. Images
+    not finished by archiver.DEFAULT_ARCHIVE_DEADLINE are left out.
+    """
+    semaphore = asyncio.Semaphore(ARCHIVE_DOWNLOAD_CONCURRENCY)
+    async def download(url):
+        async with semaphore:
+            try:
+                with metrics.stage('image_download'):
+                    return url if await fetch_image(url) else None
+            except image_store.ImageRejected as e:
+                print(f"Изображение {url} пропущено: {e}")
+            except _FETCH_ERRORS as e:
+                print(f"Ошибка сети при скачивании изображения {url}: {e}")
+                metrics.count('errors_total', site=sites.site_name(url), stage='image_download')
+            except Exception as e:
+                # Как archiver.download_image: ошибка диска или базы хранилища (sqlite3.Error)
+                # теряет одно изображение, а не весь архив
+                print(f"Ошибка скачивания изображения {url}: {e}")
+                metrics.count('errors_total', site=sites.site_name(url), stage='image_download')
+            return None
+
+    tasks = [asyncio.ensure_future(download(url)) for url in urls]
+    if not tasks: return set()
+    done, pending = await asyncio.wait(tasks, timeout=archiver.DEFAULT_ARCHIVE_DEADLINE)
+    for task in pending: task.cancel()
+    if pending: print(f"Не дождались {len(pending)} изображений: архив собирается без них")
+    return {task.result() for task in done if task.result()}
+
+def _error(message, status):
+    return JSONResponse({"error": message}, status_code=status)
+
+def _with_timings(request, payload, data):
+    if data.get('timings') or request.query_params.get('timings') in ('1', 'true'):
+        payload["timings"] = request.state.timings.as_dict()
+    return payload
+
+async def _export_products(products, data, download_name, total_items=None):
+    export_format = (data.get('format') or 'json').lower()
+    if export_format == 'json': return None
+    body, content_type, extension = await _in_thread(lambda: records.export(records.from_products(products), export_format))
+    headers = {"Content-Disposition": f"attachment; filename={download_name}.{extension}"}
+    if total_items is not None: headers["X-Total-Items"] = str(total_items)
+    return Response(body, media_type=content_type, headers=headers)
+
+def _compact_products(products, data):
+    if not data.get('compact'): return products
+    return [record.as_dict() for record in records.from_products(products)]
+
+async def _parse_catalog_cached(url, show_all=False):
+    # Как в Flask-приложении: одновременные запросы одного каталога ждут общий обход
+    async def compute():
+        products, total_items = await parse_catalog(url, show_all=show_all)
+        await _in_thread(price_history.record, products)
+        return [products, total_items] if products else None
+    key = result_cache.make_key('catalog', url, show_all=show_all)
+    return await result_cache.get_or_compute_async(key, compute) or ([], 0)
+
+async def _parse_product_cached(url):
+    async def compute():
+        product_details = await parse_product(url)
+        if product_details: await _in_thread(price_history.record, [product_details])
+        return product_details
+    return await result_cache.get_or_compute_async(result_cache.make_key('product', url), compute)
+
+def _timed(endpoint):
+    """Per-request stage breakdown, as in the Flask app: the Server-Timing
+    header, and "timings" in the JSON on request.
+    """
+    async def wrapper(request):
+        request.state.timings, token = metrics.start_request()
+        try:
+            response = await endpoint(request)
+        finally:
+            metrics.end_request(token)
+        server_timing = request.state.timings.server_timing()
+        # Для потокового архива этапы еще не закончены, как и во Flask-версии
+        if server_timing and not isinstance(response, StreamingResponse):
+            response.headers['Server-Timing'] = server_timing
+        return response
+    return wrapper
+
+async def _json_body(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+@_timed
+async def parse_url(request):
+    logging.info("Получен запрос на парсинг URL (ASGI)")
+    data = await _json_body(request)
+    if data is None:
+        return _error("Ожидается JSON-объект", 400)
+    url = data.get('url')
+
+    if not url:
+        logging.warning("URL не предоставлен в запросе на парсинг")
+        return _error("URL is required", 400)
+
+    if not re.match(r"^https?://(www\.rollingmoto\.ru/|motoland-shop\.ru/)", url):
+        logging.warning(f"Получен неверный URL: {url}")
+        return _error("Неверный URL. Поддерживаются только rollingmoto.ru и motoland-shop.ru", 400)
+
+    export_format = (data.get('format') or 'json').lower()
+    if export_format != 'json' and export_format not in records.EXPORT_FORMATS:
+        logging.warning(f"Неподдерживаемый формат выгрузки: {export_format}")
+        return _error(f"Неподдерживаемый формат выгрузки: {export_format}", 400)
+    if export_format in ('parquet', 'arrow') and not records.ARROW_AVAILABLE:
+        logging.warning(f"Выгрузка в {export_format} недоступна: не установлен pyarrow")
+        return _error(f"Выгрузка в {export_format} недоступна на этом сервере", 400)
+
+    site = sites.get_site(url)
+    if site is not None and site.is_product_url(url):
+        logging.info(f"Определение типа страницы: товар. URL: {url}")
+        product_details = await _parse_product_cached(url)
+        if not product_details:
+            logging.error(f"Ошибка парсинга страницы товара: {url}")
+            return _error("Ошибка парсинга страницы товара", 500)
+        logging.info(f"Успешно спарсен товар: {url}")
+        exported = await _export_products([product_details], data, "product")
+        if exported is not None: return exported
+        return JSONResponse(_with_timings(request, {"type": "product", "details": _compact_products([product_details], data)[0]}, data))
+
+    logging.info(f"Определение типа страницы: каталог. URL: {url}")
+    if data.get('incremental'):
+        # Состояние инкрементального обхода хранится на диске, обходы одного каталога в процессе
+        # сериализует threading.Lock модуля incremental: поэтому обход целиком идет в потоке
+        diff = await asyncio.to_thread(parse_catalog_incremental, url)
+        if diff is None:
+            logging.error(f"Ошибка инкрементального обхода каталога: {url}")
+            return _error("Ошибка парсинга каталога или товары не найдены", 500)
+        return JSONResponse(_with_timings(request, {"type": "catalog_diff", **diff}, data))
+    products, total_items = await _parse_catalog_cached(url, show_all=bool(data.get('show_all')))
+    if not products:
+        logging.error(f"Ошибка парсинга каталога или товары не найдены: {url}")
+        return _error("Ошибка парсинга каталога или товары не найдены", 500)
+    logging.info(f"Успешно спарсен каталог: {url}, найдено товаров: {total_items}")
+    exported = await _export_products(products, data, "catalog", total_items)
+    if exported is not None: return exported
+    return JSONResponse(_with_timings(request, {"type": "catalog", "products": _compact_products(products, data), "totalItems": total_items}, data))
+
+@_timed
+async def download_archive(request):
+    logging.info("Получен запрос на скачивание архива (ASGI)")
+    data = await _json_body(request)
+    products_data = (data or {}).get('products_data')
+    if not products_data:
+        logging.warning("Список товаров для архива не предоставлен")
+        return _error("Список товаров для архива обязателен", 400)
+    try:
+        processing = normalize_options(data.get('processing'))
+    except ValueError as e:
+        logging.warning(f"Неверные параметры обработки изображений: {e}")
+        return _error(str(e), 400)
+
+    # Сначала все изображения параллельно загружаются в хранилище, затем ZIP собирается
+    # из локальных файлов: генератор archiver.stream_zip_archive Starlette крутит в своем пуле потоков
+    urls = list(dict.fromkeys(url for product in products_data for url in product.get("images", [])))
+    stored = await _download_images(urls)
+    products_data = [{**product, "images": [url for url in product.get("images", []) if url in stored]}
+                     for product in products_data]
+    logging.info(f"Изображения для архива загружены: {len(stored)} из {len(urls)}")
+    return StreamingResponse(
+        archiver.stream_zip_archive(products_data, processing=processing),
+        media_type='application/zip',
+        headers={"Content-Disposition": "attachment; filename=product_images.zip"},
+    )
+
+async def price_changes(request):
+    since = request.query_params.get('since')
+    if not since:
+        return _error("Параметр since обязателен", 400)
+    try:
+        since = price_history.parse_since(since)
+        limit = int(request.query_params.get('limit', price_history.DEFAULT_CHANGES_LIMIT))
+    except ValueError:
+        logging.warning(f"Неверные параметры запроса изменений цен: {dict(request.query_params)}")
+        return _error("Неверное значение since или limit", 400)
+    changes = await _in_thread(lambda: price_history.changes_since(
+        since, site=request.query_params.get('site'),
+        include_new=request.query_params.get('include_new') in ('1', 'true'), limit=limit))
+    return JSONResponse({"since": since, "changes": changes})
+
+async def product_price_history(request):
+    link = request.query_params.get('link')
+    if not link:
+        return _error("Параметр link обязателен", 400)
+    product_history = await _in_thread(price_history.history, link)
+    if product_history is None:
+        return _error("Товар еще не встречался в разобранных каталогах", 404)
+    return JSONResponse(product_history)
+
+async def prometheus_metrics(request):
+    return Response(metrics.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+@asynccontextmanager
+async def lifespan(app):
+    parse_pool.start()
+    yield
+    parse_pool.shutdown()
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+app = Starlette(
+    routes=[
+        Route('/parse_url', parse_url, methods=['POST']),
+        Route('/download_archive', download_archive, methods=['POST']),
+        Route('/price_changes', price_changes),
+        Route('/price_history', product_price_history),
+        Route('/metrics', prometheus_metrics),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan,
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
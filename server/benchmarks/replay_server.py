@@ -0,0 +1,186 @@
+"""Local stand-in for the supported shops: replays the saved pages from
+benchmarks/fixtures with a configurable response delay.
+
+Every shop is served under its own prefix, e.g. for --port 8765:
+    http://127.0.0.1:8765/rollingmoto/catalog/bench/            catalog, PAGEN_1=n for page n
+    http://127.0.0.1:8765/rollingmoto/catalog/mototekhnika/bench-7/   product page
+    http://127.0.0.1:8765/motoland/catalog/bench/
+    http://127.0.0.1:8765/motoland/catalog/mototsikly/bench/7/
+    http://127.0.0.1:8765/motoland/catalog/section-3/             catalog section linked from the menu (so is catalog/)
+    .../upload/iblock/7/image-1.jpg                              image
+
+Run standalone:
+    python benchmarks/replay_server.py --port 8765 --latency 50
+"""
+import argparse
+import io
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+SITES = ('rollingmoto', 'motoland')
+CATALOG_PATH = 'catalog/bench/'
+
+BRANDS = ['KAYO', 'MOTOLAND', 'BSE', 'ZUUMAV', 'AVANTIS', 'IRBIS']
+MODELS = ['T2 250 ENDURO', 'XR250 LITE', 'K1 250 MX', 'FX 125', 'ENDURO 300 PRO', 'TT 140']
+
+def _read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+def _render(template, values):
+    for key, value in values.items():
+        template = template.replace('{{' + key + '}}', str(value))
+    return template
+
+def _money(value):
+    return f"{value:,}".replace(',', ' ')
+
+def _product_values(n):
+    price = 90000 + n * 137 % 60000
+    old_price = price + price // 10
+    return {
+        'N': n, 'BRAND': BRANDS[n % len(BRANDS)], 'MODEL': MODELS[n // len(BRANDS) % len(MODELS)],
+        'YEAR': 2018 + n % 7, 'PRICE': _money(price), 'PRICE_VALUE': price,
+        'OLD_PRICE': _money(old_price), 'OLD_PRICE_VALUE': old_price, 'ECONOMY': _money(old_price - price),
+    }
+
+def _make_image(width, height):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 40, 40)).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+class ReplayConfig:
+    def __init__(self, pages=10, per_page=20, latency=0.0, jitter=0.0, nav_items=300, image_size=(800, 600)):
+        self.pages = pages
+        self.per_page = per_page
+        self.latency = latency # Секунды до ответа
+        self.jitter = jitter # Плюс случайная добавка от 0 до jitter секунд
+        self.nav_items = nav_items # Пунктов меню на странице: разметка, которую парсер должен пропустить
+        self.image = _make_image(*image_size)
+
+    @property
+    def total_items(self):
+        return self.pages * self.per_page
+
+class ReplayServer:
+    def __init__(self, config, host='127.0.0.1', port=0):
+        self.config = config
+        self.templates = {
+            (site, kind): _read_fixture(f"{site}_{kind}.html") for site in SITES for kind in ('catalog', 'card', 'product')
+        }
+        nav = ''.join(f'<li class="menu-item"><a href="/catalog/section-{i}/" class="dark_link">Раздел {i}</a></li>'
+                      for i in range(config.nav_items))
+        self.nav = nav
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def site_url(self, site):
+        return f"{self.url}{site}/"
+
+    def catalog_url(self, site):
+        return f"{self.site_url(site)}{CATALOG_PATH}"
+
+    def product_url(self, site, n):
+        if site == 'rollingmoto':
+            return f"{self.site_url(site)}catalog/mototekhnika/bench-{n}/"
+        return f"{self.site_url(site)}catalog/mototsikly/bench/{n}/"
+
+    def image_urls(self, site, n, count=3):
+        return [f"{self.site_url(site)}upload/iblock/{n}/image-{i}.jpg" for i in range(1, count + 1)]
+
+    def catalog_page(self, site, page, offset=0):
+        config = self.config
+        first = (page - 1) * config.per_page
+        ids = range(offset + first, offset + min(first + config.per_page, config.total_items))
+        card = self.templates[(site, 'card')]
+        pagination = ''.join(f'<a href="/{CATALOG_PATH}?PAGEN_1={p}" class="dark_link">{p}</a>' for p in range(1, config.pages + 1))
+        return _render(self.templates[(site, 'catalog')], {
+            'NAV': self.nav, 'TOTAL': config.total_items, 'PAGINATION': pagination,
+            'CARDS': '\n'.join(_render(card, _product_values(n)) for n in ids),
+        })
+
+    def product_page(self, site, n):
+        return _render(self.templates[(site, 'product')], dict(_product_values(n), NAV=self.nav))
+
+    def image(self, n):
+        # Хвост после конца JPEG декодеры игнорируют, а хэш у каждого изображения свой
+        return self.config.image + n.to_bytes(8, 'big')
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                config = server.config
+                time.sleep(config.latency + (random.random() * config.jitter if config.jitter else 0))
+                parts = urlsplit(self.path)
+                site, _, rest = parts.path.lstrip('/').partition('/')
+                numbers = re.findall(r'\d+', rest)
+                if site not in SITES:
+                    return self._send(404, b'', 'text/plain')
+                if rest in (CATALOG_PATH, 'catalog/') or rest.startswith('catalog/section-'):
+                    page = int(parse_qs(parts.query).get('PAGEN_1', ['1'])[0])
+                    # Разделы показывают сдвинутые, частично пересекающиеся наборы товаров
+                    offset = int(numbers[0]) * config.per_page // 2 if numbers else 0
+                    return self._send(200, server.catalog_page(site, page, offset).encode('utf-8'), 'text/html; charset=utf-8')
+                if rest.startswith('upload/') and numbers:
+                    return self._send(200, server.image(int(numbers[0]) * 10 + int(numbers[-1])), 'image/jpeg')
+                if numbers:
+                    return self._send(200, server.product_page(site, int(numbers[-1])).encode('utf-8'), 'text/html; charset=utf-8')
+                return self._send(404, b'', 'text/plain')
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8765)
+    arg_parser.add_argument('--pages', type=int, default=10)
+    arg_parser.add_argument('--per-page', type=int, default=20)
+    arg_parser.add_argument('--latency', type=float, default=0, help='response delay, ms')
+    arg_parser.add_argument('--jitter', type=float, default=0, help='extra random delay up to this many ms')
+    args = arg_parser.parse_args()
+    config = ReplayConfig(pages=args.pages, per_page=args.per_page, latency=args.latency / 1000, jitter=args.jitter / 1000)
+    server = ReplayServer(config, args.host, args.port)
+    print(f"Replaying fixtures on {server.url} (catalogs: {', '.join(server.catalog_url(site) for site in SITES)})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Offline throughput benchmark for the catalog, product and archive flows.
+
+Starts benchmarks/replay_server.py in-process and runs every flow against it
+for both shops. Each flow runs in a fresh process, so its peak RSS is not
+mixed with the others. Run from the server directory:
+    python benchmarks/run.py [--flows catalog,product,archive] [--latency 20] [--json results.json]
+
+For the archive flow a "page" is one downloaded image.
+"""
+import argparse
+import copy
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from replay_server import SITES, ReplayConfig, ReplayServer # noqa: E402
+
+FLOWS = ('catalog', 'product', 'archive')
+
+def _peak_rss_bytes():
+    try:
+        import resource
+    except ImportError: # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024 # В Linux ru_maxrss в килобайтах
+
+def _percentile(values, q):
+    if not values: return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))]
+
+def _timed(module, name, latencies):
+    """Replaces module.name with a wrapper that records the duration of every call."""
+    original = getattr(module, name)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    setattr(module, name, wrapper)
+
+def _point_sites_to(server_url):
+    # Адаптеры сайтов с теми же селекторами, но с корнем на локальном сервере
+    import sites
+    for adapter in list(sites.SITES):
+        local = copy.copy(adapter)
+        local.domain = local.root_url = f"{server_url}{adapter.name}/"
+        sites.register(local)
+
+def _run_flow(flow, site, server_url, options):
+    """Runs one flow in the current (worker) process and returns its measurements."""
+    import http_cache
+    import image_store
+    import throttle
+    _point_sites_to(server_url)
+    throttle.configure(enabled=options['throttle']) # По умолчанию меряем сам парсер, а не ограничение частоты
+    http_cache.configure(enabled=False) # Меряем парсинг, а не попадания в кэш
+    store_dir = tempfile.mkdtemp(prefix='bench-images-')
+    image_store.configure(store_dir=store_dir)
+
+    import archiver
+    import parse_pool
+    import parser_logic
+    from replay_server import CATALOG_PATH
+    # Процессы разбора запускаются до замера: в рабочем режиме они тоже живут долго
+    parse_pool.configure(processes=options['parse_processes'])
+    parse_pool.start()
+    site_url = f"{server_url}{site}/"
+    product_urls = [
+        f"{site_url}catalog/mototekhnika/bench-{n}/" if site == 'rollingmoto' else f"{site_url}catalog/mototsikly/bench/{n}/"
+        for n in range(options['products'])
+    ]
+    rss_before = _peak_rss_bytes()
+    latencies = []
+    pages = products = 0
+    start = time.perf_counter()
+    try:
+        if flow == 'catalog':
+            _timed(parser_logic, '_parse_catalog_page', latencies)
+            for batch in parser_logic.iter_catalog(f"{site_url}{CATALOG_PATH}", max_workers=options['workers']):
+                if batch['page'] == 1: latencies.append(time.perf_counter() - start)
+                pages += 1
+                products += len(batch['products'])
+        elif flow == 'product':
+            _timed(parser_logic, 'parse_product', latencies)
+            results = parser_logic.parse_products(product_urls, max_workers=options['workers'])
+            pages = len(results)
+            products = sum(1 for result in results.values() if 'details' in result)
+        elif flow == 'archive':
+            _timed(archiver, 'download_image', latencies)
+            product_data = [
+                {'name': f"Товар {n}", 'images': [f"{site_url}upload/iblock/{n}/image-{i}.jpg" for i in range(1, 4)]}
+                for n in range(options['products'])
+            ]
+            archive_path = archiver.create_zip_archive(product_data, max_workers=options['workers'])
+            shutil.rmtree(os.path.dirname(archive_path), ignore_errors=True)
+            pages = len(latencies)
+            products = len(product_data)
+        else:
+            raise ValueError(f"Неизвестный сценарий: {flow}")
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+        parse_pool.shutdown()
+
+    return {
+        'flow': flow,
+        'site': site,
+        'pages': pages,
+        'products': products,
+        'seconds': elapsed,
+        'pages_per_s': pages / elapsed if elapsed else None,
+        'products_per_s': products / elapsed if elapsed else None,
+        'p50_ms': _percentile(latencies, 50) * 1000 if latencies else None,
+        'p99_ms': _percentile(latencies, 99) * 1000 if latencies else None,
+        'rss_before_mb': rss_before / 2**20 if rss_before else None,
+        'peak_rss_mb': _peak_rss_bytes() / 2**20 if rss_before else None,
+    }
+
+def _format(value, spec):
+    return format(value, spec) if value is not None else '-'
+
+def print_report(results):
+    header = f"{'flow':<8} {'site':<12} {'pages':>6} {'pages/s':>9} {'products':>9} {'products/s':>11} {'p50 ms':>8} {'p99 ms':>8} {'peak RSS MB':>12}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['flow']:<8} {r['site']:<12} {r['pages']:>6} {_format(r['pages_per_s'], '9.1f')} {r['products']:>9} "
+              f"{_format(r['products_per_s'], '11.1f')} {_format(r['p50_ms'], '8.1f')} {_format(r['p99_ms'], '8.1f')} "
+              f"{_format(r['peak_rss_mb'], '12.1f')}")
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--flows', default=','.join(FLOWS), help='comma-separated: ' + ', '.join(FLOWS))
+    arg_parser.add_argument('--sites', default=','.join(SITES))
+    arg_parser.add_argument('--pages', type=int, default=10, help='catalog pages per shop')
+    arg_parser.add_argument('--per-page', type=int, default=20, help='products per catalog page')
+    arg_parser.add_argument('--products', type=int, default=100, help='product pages / archive products per shop')
+    arg_parser.add_argument('--workers', type=int, default=8)
+    arg_parser.add_argument('--latency', type=float, default=20, help='server response delay, ms')
+    arg_parser.add_argument('--jitter', type=float, default=0, help='extra random delay up to this many ms')
+    arg_parser.add_argument('--throttle', action='store_true', help='keep the per-host rate and concurrency limits on')
+    arg_parser.add_argument('--parse-processes', type=int, default=0, help='parse HTML in this many processes (parse_pool)')
+    arg_parser.add_argument('--json', help='also write the results to this file')
+    args = arg_parser.parse_args()
+
+    config = ReplayConfig(pages=args.pages, per_page=args.per_page, latency=args.latency / 1000, jitter=args.jitter / 1000)
+    server = ReplayServer(config).start()
+    options = {'products': args.products, 'workers': args.workers, 'throttle': args.throttle,
+               'parse_processes': args.parse_processes}
+    results = []
+    try:
+        for flow in args.flows.split(','):
+            for site in args.sites.split(','):
+                # Новый процесс на каждый сценарий: пиковый RSS не накапливается между ними
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                    results.append(executor.submit(_run_flow, flow.strip(), site.strip(), server.url, options).result())
+    finally:
+        server.stop()
+
+    print(f"latency {args.latency:g} ms (+{args.jitter:g} jitter), {args.workers} workers, "
+          f"{args.parse_processes or 'no'} parser processes")
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'options': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Micro-benchmark for product title parsing and URL normalization.
+
+Run from the server directory:
+    python benchmarks/title_parsing.py [--titles 20000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parser_logic # noqa: E402
+from urls import normalize_url_slashes # noqa: E402
+
+BRANDS = ['KAYO', 'MOTOLAND', 'BSE', 'ZUUMAV', 'GR7', 'AVANTIS', 'ЗИД', 'IRBIS']
+MODELS = ['T2 250 ENDURO', 'XR250 LITE', 'K1 250 MX', 'FX 125', 'ENDURO 300 PRO', 'TT 140']
+KINDS = ['Мотоцикл', 'Питбайк', 'Квадроцикл', 'Эндуро']
+
+def _legacy_parse_vehicle_description(description):
+    # Реализация до оптимизации: шаблон модели компилируется на каждый вызов
+    brand_match = re.search(r'\b([A-ZА-Я]{2,})\b', description)
+    brand = brand_match.group(1) if brand_match else ""
+    model_pattern = re.compile(rf'{brand}\s+(.*?)\s+\(?\d{{4}}')
+    model_match = model_pattern.search(description)
+    model = model_match.group(1).strip() if model_match else ""
+    year_match = re.search(r'\(?(\d{4})\)?\s*г?\.', description)
+    year = year_match.group(1) if year_match else ""
+    return brand, model, year
+
+def _legacy_normalize_url_slashes(url):
+    protocol, rest = url.split('://', 1)
+    domain, path = rest.split('/', 1)
+    return f"{protocol}://{domain}/{re.sub(r'/{2,}', '/', path).lstrip('/')}"
+
+def make_titles(count, unique):
+    """count titles drawn from `unique` distinct ones."""
+    rng = random.Random(42)
+    pool = [f"{rng.choice(KINDS)} {rng.choice(BRANDS)} {rng.choice(MODELS)} v{i} ({rng.randint(2015, 2025)} г.)" for i in range(unique)]
+    return [rng.choice(pool) for _ in range(count)] if unique < count else pool[:count]
+
+def bench(label, func, repeat, count):
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    print(f"{label:<44} {best * 1e9 / count:10.0f} ns/item")
+    return best
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--titles', type=int, default=20000)
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    mixed = make_titles(args.titles, unique=args.titles // 20)
+    distinct = make_titles(args.titles, unique=args.titles)
+    assert [_legacy_parse_vehicle_description(t) for t in mixed] == parser_logic.parse_vehicle_descriptions(mixed)
+
+    print(f"{args.titles} titles, best of {args.repeat}")
+    for label, titles in (("repeated titles", mixed), ("distinct titles", distinct)):
+        bench(f"legacy, {label}", lambda: [_legacy_parse_vehicle_description(t) for t in titles], args.repeat, len(titles))
+        def batched():
+            parser_logic.parse_vehicle_description.cache_clear()
+            parser_logic.parse_vehicle_descriptions(titles)
+        bench(f"batched, {label}", batched, args.repeat, len(titles))
+
+    urls = [f"https://www.rollingmoto.ru/catalog/mototekhnika/item{i}/" for i in range(args.titles)]
+    bench("legacy normalize_url_slashes", lambda: [_legacy_normalize_url_slashes(u) for u in urls], args.repeat, len(urls))
+    bench("normalize_url_slashes", lambda: [normalize_url_slashes(u) for u in urls], args.repeat, len(urls))
+
+if __name__ == '__main__':
+    main()
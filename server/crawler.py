@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import tempfile
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+from bs4 import BeautifulSoup
+import http_cache
+import metrics
+import parser_logic
+import price_history
+import sites
+from urls import normalize_link, normalize_url_slashes
+
+# Ночной обход многих каталогов обоих магазинов: разделы берутся из списка или
+# находятся по ссылкам с корня каталога, страницы всех каталогов планируются в
+# отдельные пулы для каждого хоста, товары склеиваются по ссылке. Готовые страницы
+# дописываются в журнал на диске, и прерванный обход продолжается с того же места.
+CRAWL_DIR = os.path.join(tempfile.gettempdir(), 'mono-uniparser-crawls')
+DEFAULT_PAGES_PER_HOST = 4 # Страниц одного хоста в работе одновременно (частоту дополнительно ограничивает throttle)
+DEFAULT_DISCOVERY_DEPTH = 2 # Уровней разделов под корнем каталога
+
+def discover_catalogs(root_url, depth=DEFAULT_DISCOVERY_DEPTH):
+    """Finds catalog sections by following section links from root_url (the
+    menus of these shops list the whole section tree) down to `depth` levels.
+    """
+    site = sites.get_site(root_url)
+    if site is None:
+        raise ValueError(f"Неподдерживаемый сайт: {root_url}")
+    root_url = normalize_url_slashes(root_url)
+    found = []
+    seen = {root_url}
+    queue = deque([(root_url, 0)])
+    while queue:
+        url, level = queue.popleft()
+        if level >= depth: continue
+        try:
+            with metrics.stage('fetch'):
+                response = http_cache.get(url, timeout=10)
+                response.raise_for_status()
+            with metrics.stage('parse'):
+                soup = BeautifulSoup(response.text, parser_logic.HTML_PARSER)
+        except Exception as e:
+            print(f"Ошибка загрузки раздела {url} при поиске каталогов: {e}")
+            metrics.count('errors_total', site=site.name, stage='discovery')
+            continue
+        for link in site.category_links(soup):
+            if link in seen: continue
+            seen.add(link)
+            found.append(link)
+            queue.append((link, level + 1))
+    return found
+
+class CrawlLog:
+    """Append-only JSON-lines journal of a crawl. A line is written once a
+    piece of work is finished, so replaying the file restores everything
+    done before an interruption; a torn last line is ignored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.seeds = None
+        self.catalogs = {} # url -> {"totalPages", "totalItems", "pages": {n: products}, "endPage"}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue # Строка, не дописанная при обрыве
+            self._apply(entry)
+
+    def _apply(self, entry):
+        kind = entry['type']
+        if kind == 'seeds':
+            self.seeds = entry['urls']
+        elif kind == 'catalog':
+            # Первая страница пишется вместе с размером каталога одной строкой
+            self.catalogs[entry['url']] = {"totalPages": entry['totalPages'], "totalItems": entry['totalItems'],
+                                           "pages": {1: entry['products']}, "endPage": None}
+        elif kind == 'page':
+            self.catalogs[entry['url']]['pages'][entry['page']] = entry['products']
+        elif kind == 'end':
+            self.catalogs[entry['url']]['endPage'] = entry['page']
+
+    def write(self, **entry):
+        with self._lock:
+            self._apply(entry)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def missing_pages(self, url):
+        catalog = self.catalogs[url]
+        last_page = catalog['endPage'] - 1 if catalog['endPage'] else catalog['totalPages']
+        return [n for n in range(2, last_page + 1) if n not in catalog['pages']]
+
+def _host(url):
+    return urlsplit(url).netloc
+
+def crawl(seeds=(), discover_from=(), crawl_id=None, pages_per_host=DEFAULT_PAGES_PER_HOST,
+          depth=DEFAULT_DISCOVERY_DEPTH, progress=None):
+    """Crawls every seed catalog (plus the sections discovered under the
+    discover_from roots) and returns the products deduplicated by link:
+    {"crawlId", "products", "catalogs": {url: {...}}, "duplicates", "resumed"}.
+
+    Passing the crawlId of an interrupted crawl resumes it: finished pages
+    are taken from the journal and only the rest is fetched.
+    progress(state) is called after every finished page.
+    """
+    crawl_id = crawl_id or uuid.uuid4().hex
+    log = CrawlLog(os.path.join(CRAWL_DIR, f"{crawl_id}.jsonl"))
+    resumed = log.seeds is not None
+    if not resumed:
+        urls = [normalize_url_slashes(url) for url in seeds]
+        for root_url in discover_from:
+            urls.extend(discover_catalogs(root_url, depth))
+        for url in urls:
+            if sites.get_site(url) is None:
+                raise ValueError(f"Неподдерживаемый сайт: {url}")
+        log.write(type='seeds', urls=list(dict.fromkeys(urls)))
+    seeds = log.seeds
+
+    executors = {}
+    futures = {}
+
+    def submit(task, url, page_num=1):
+        host = _host(url)
+        if host not in executors:
+            executors[host] = ThreadPoolExecutor(max_workers=pages_per_host, thread_name_prefix=f'crawl-{host}')
+        if task == 'first':
+            future = executors[host].submit(metrics.bind(parser_logic.parse_first_catalog_page), url)
+        else:
+            future = executors[host].submit(metrics.bind(parser_logic.parse_catalog_page), url, page_num)
+        futures[future] = (task, url, page_num)
+
+    def report():
+        if progress is None: return
+        pages_done = sum(len(catalog['pages']) for catalog in log.catalogs.values())
+        progress({"catalogs": len(seeds), "catalogsStarted": len(log.catalogs), "pagesDone": pages_done,
+                  "pagesQueued": len(futures)})
+
+    for url in seeds:
+        if url in log.catalogs:
+            for page_num in log.missing_pages(url): submit('page', url, page_num)
+        else:
+            submit('first', url)
+
+    try:
+        while futures:
+            done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                task, url, page_num = futures.pop(future)
+                result = future.result()
+                if task == 'first':
+                    if result is None: continue # Каталог не загрузился; при возобновлении попробуем снова
+                    _, total_items, total_pages, products = result
+                    log.write(type='catalog', url=url, totalPages=total_pages, totalItems=total_items, products=products)
+                    # Все страницы каталога сразу попадают в очередь своего хоста вместе со страницами других каталогов
+                    for n in log.missing_pages(url): submit('page', url, n)
+                elif result is None:
+                    end_page = log.catalogs[url]['endPage']
+                    if end_page is None or page_num < end_page:
+                        log.write(type='end', url=url, page=page_num) # Каталог оказался короче: дальше страниц нет
+                elif result:
+                    log.write(type='page', url=url, page=page_num, products=result)
+                # Пустой список — ошибка загрузки: страницу не отмечаем, при возобновлении она загрузится снова
+                report()
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    products = []
+    seen = set()
+    duplicates = 0
+    catalogs = {}
+    for url in seeds:
+        catalog = log.catalogs.get(url)
+        if catalog is None:
+            catalogs[url] = {"status": "failed"}
+            continue
+        end_page = catalog['endPage']
+        count = 0
+        previous_products = []
+        for page_num in sorted(catalog['pages']):
+            if end_page and page_num >= end_page: break
+            page_products = catalog['pages'][page_num]
+            if parser_logic.same_products(page_products, previous_products):
+                break # Сайт повторяет последнюю страницу: каталог короче, чем обещал счетчик
+            previous_products = page_products
+            for product in page_products:
+                count += 1
+                key = normalize_link(product['link'])
+                if key in seen:
+                    duplicates += 1 # Товар уже пришел из другого раздела
+                    continue
+                seen.add(key)
+                products.append(product)
+        catalogs[url] = {"status": "done" if not log.missing_pages(url) else "partial",
+                         "totalItems": catalog['totalItems'], "pagesParsed": len(catalog['pages']), "products": count}
+    return {"crawlId": crawl_id, "products": products, "catalogs": catalogs, "duplicates": duplicates, "resumed": resumed}
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Crawls many catalogs of the supported shops.")
+    arg_parser.add_argument('--seed', action='append', default=[], help='catalog URL; repeat for several')
+    arg_parser.add_argument('--discover', action='append', default=[], help='catalog root to discover sections from')
+    arg_parser.add_argument('--depth', type=int, default=DEFAULT_DISCOVERY_DEPTH)
+    arg_parser.add_argument('--pages-per-host', type=int, default=DEFAULT_PAGES_PER_HOST)
+    arg_parser.add_argument('--parse-processes', type=int, default=0,
+                            help='parse HTML in this many processes (with --pages-per-host at least as large per host)')
+    arg_parser.add_argument('--crawl-id', help='resume the crawl with this id')
+    arg_parser.add_argument('--output', required=True, help='result file: .json or .csv')
+    args = arg_parser.parse_args()
+    if not args.seed and not args.discover and not args.crawl_id:
+        arg_parser.error("нужен --seed, --discover или --crawl-id")
+    if args.parse_processes:
+        import parse_pool
+        parse_pool.configure(processes=args.parse_processes)
+        parse_pool.start()
+
+    result = crawl(args.seed, args.discover, crawl_id=args.crawl_id, pages_per_host=args.pages_per_host, depth=args.depth,
+                   progress=lambda state: print(f"\rстраниц: {state['pagesDone']}, в очереди: {state['pagesQueued']}", end=''))
+    print()
+    price_history.record(result['products'])
+    if args.output.endswith('.csv'):
+        import records
+        with open(args.output, 'wb') as f:
+            f.write(records.to_csv(records.from_products(result['products'])))
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+    print(f"Обход {result['crawlId']}: каталогов {len(result['catalogs'])}, товаров {len(result['products'])}, "
+          f"повторов {result['duplicates']}")
+
+if __name__ == '__main__':
+    main()
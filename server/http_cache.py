@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import requests
+from requests.structures import CaseInsensitiveDict
+import http_client
+import metrics
+from urls import normalize_url_slashes
+
+# Дисковый кэш HTTP-ответов для страниц сайтов (изображения хранит image_store)
+CACHE_ENABLED = True
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'mono-uniparser-http-cache')
+CACHE_TTL = 300 # Секунд, в течение которых ответ отдается без обращения к сайту
+CACHE_MAX_BYTES = 512 * 1024 * 1024 # При превышении удаляются давно не использованные записи
+
+_lock = threading.Lock()
+_cache_size = None # Текущий размер кэша в байтах; считается при первой записи
+
+class CachedResponse:
+    """The part of requests.Response that the parser and the archiver use,
+    restored from the cache.
+    """
+
+    def __init__(self, url, content, meta):
+        self.url = url
+        self.content = content
+        self.status_code = meta.get('status_code', 200)
+        self.encoding = meta.get('encoding')
+        self.headers = CaseInsensitiveDict(meta.get('headers', {}))
+        self.from_cache = True
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+def configure(enabled=None, cache_dir=None, ttl=None, max_bytes=None):
+    global CACHE_ENABLED, CACHE_DIR, CACHE_TTL, CACHE_MAX_BYTES, _cache_size
+    with _lock:
+        if enabled is not None: CACHE_ENABLED = enabled
+        if cache_dir is not None:
+            CACHE_DIR = cache_dir
+            _cache_size = None
+        if ttl is not None: CACHE_TTL = ttl
+        if max_bytes is not None: CACHE_MAX_BYTES = max_bytes
+
+def _entry_paths(url):
+    key = hashlib.sha256(normalize_url_slashes(url).encode('utf-8')).hexdigest()
+    entry_dir = os.path.join(CACHE_DIR, key[:2])
+    return os.path.join(entry_dir, key + '.json'), os.path.join(entry_dir, key + '.body')
+
+def _load(meta_path, body_path):
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(body_path, 'rb') as f:
+            content = f.read()
+        return meta, content
+    except (OSError, ValueError):
+        return None, None
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _save_meta(meta_path, meta):
+    _write_atomic(meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+def _scan():
+    entries = []
+    for root, dirs, files in os.walk(CACHE_DIR):
+        for file in files:
+            if not file.endswith('.body'): continue
+            body_path = os.path.join(root, file)
+            try:
+                stat = os.stat(body_path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, body_path))
+    return entries
+
+def _evict():
+    """Drops least recently used entries until the cache is 10% below the cap.
+    Must be called with _lock held.
+    """
+    global _cache_size
+    entries = sorted(_scan())
+    _cache_size = sum(size for _, size, _ in entries)
+    target = CACHE_MAX_BYTES * 0.9
+    for _, size, body_path in entries:
+        if _cache_size <= target: break
+        for path in (body_path, body_path[:-len('.body')] + '.json'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        _cache_size -= size
+
+def _store(url, meta_path, body_path, response):
+    global _cache_size
+    meta = {
+        'url': url,
+        'status_code': response.status_code,
+        'encoding': response.encoding or getattr(response, 'apparent_encoding', None),
+        'headers': {name: response.headers[name] for name in ('Content-Type', 'ETag', 'Last-Modified') if name in response.headers},
+        'stored_at': time.time(),
+    }
+    _write_atomic(body_path, response.content)
+    _save_meta(meta_path, meta)
+    with _lock:
+        if _cache_size is None:
+            _cache_size = sum(size for _, size, _ in _scan())
+        else:
+            _cache_size += len(response.content)
+        if _cache_size > CACHE_MAX_BYTES:
+            _evict()
+
+class CacheEntry:
+    """What begin() found on disk for a URL that still needs a request."""
+
+    def __init__(self, url, meta_path, body_path, meta, content):
+        self.url = url
+        self.meta_path = meta_path
+        self.body_path = body_path
+        self.meta = meta
+        self.content = content
+        self.headers = {} # Заголовки условного запроса
+        if meta is not None:
+            if 'ETag' in meta['headers']: self.headers['If-None-Match'] = meta['headers']['ETag']
+            if 'Last-Modified' in meta['headers']: self.headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+
+def begin(url):
+    """First half of get() for callers with their own HTTP client (the ASGI
+    app). Returns (response, None) for a fresh entry, otherwise (None, entry);
+    the caller sends GET with entry.headers and passes the response to finish().
+    """
+    if not CACHE_ENABLED: return None, CacheEntry(url, None, None, None, None)
+    meta_path, body_path = _entry_paths(url)
+    meta, content = _load(meta_path, body_path)
+    if meta is not None:
+        if time.time() - meta['stored_at'] < CACHE_TTL:
+            try:
+                os.utime(body_path) # Отмечаем использование для LRU-вытеснения
+            except OSError:
+                pass
+            metrics.count('http_cache_requests_total', result='hit')
+            return CachedResponse(url, content, meta), None
+    return None, CacheEntry(url, meta_path, body_path, meta, content)
+
+def get(url, timeout=http_client.DEFAULT_TIMEOUT):
+    """GET through the on-disk cache. Fresh entries are returned without a
+    request, stale ones are revalidated with If-None-Match/If-Modified-Since.
+    """
+    cached, entry = begin(url)
+    if cached is not None: return cached
+    return finish(entry, http_client.get(url, timeout=timeout, headers=entry.headers))
+
+def finish(entry, response):
+    """Second half of get(): turns 304 into the cached body and stores a new
+    200 response. Returns the response to use.
+    """
+    url, meta_path, body_path, meta, content = entry.url, entry.meta_path, entry.body_path, entry.meta, entry.content
+    metrics.count('http_bytes_total', len(response.content), kind='page')
+    if not CACHE_ENABLED: return response
+    if response.status_code == 304 and meta is not None:
+        # Содержимое не изменилось: продлеваем запись, тело берем с диска
+        meta['stored_at'] = time.time()
+        try:
+            _save_meta(meta_path, meta)
+            os.utime(body_path)
+        except OSError as e:
+            print(f"Ошибка обновления записи кэша {url}: {e}")
+        metrics.count('http_cache_requests_total', result='revalidated')
+        return CachedResponse(url, content, meta)
+
+    metrics.count('http_cache_requests_total', result='miss')
+
+    if response.status_code == 200 and response.content:
+        # Cache-Control сайта не учитываем: Bitrix помечает каталог no-store, а нам важен именно повторный парсинг
+        try:
+            _store(url, meta_path, body_path, response)
+        except OSError as e:
+            print(f"Ошибка записи в кэш {url}: {e}")
+    return response
@@ -0,0 +1,89 @@
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+import throttle
+
+# Настройки пула соединений и повторов; меняются через configure()
+POOL_CONNECTIONS = 10 # Сколько хостов держим в пуле одновременно
+POOL_SIZE = 20 # Максимум keep-alive соединений к одному хосту
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5 # Паузы между повторами: 0.5, 1, 2... секунд
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+DEFAULT_TIMEOUT = 10
+
+_session = None
+_session_lock = threading.Lock()
+
+def retry_after_seconds(value):
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None # Дата в Retry-After: паузу выдержит сам Retry
+
+class ThrottledRetry(Retry):
+    """Retry that reports every 429/503 to the per-host throttle and takes a
+    rate token before each repeated attempt, so retries inside urllib3 are
+    limited like ordinary requests.
+    """
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        host = _pool.host if _pool is not None else None
+        if response is not None and response.status in throttle.OVERLOAD_STATUSES:
+            throttle.report_overload(host, retry_after_seconds(response.headers.get('Retry-After')))
+        new_retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        throttle.wait_for_token(host)
+        return new_retry
+
+def _build_session():
+    retry = ThrottledRetry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=True,
+        raise_on_status=False, # Последний ответ отдаем вызывающему коду, raise_for_status решает он
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # gzip/deflate всегда, br — если установлен brotli (иначе urllib3 не сможет распаковать ответ)
+    session.headers.update(make_headers(accept_encoding=True))
+    return session
+
+def get_session():
+    """Returns the process-wide session shared by the parser and the archiver.
+
+    The adapters' connection pools are thread-safe, so one session is reused
+    by all worker threads and keeps connections to each host alive.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+def configure(pool_size=None, pool_connections=None, max_retries=None, backoff_factor=None):
+    global POOL_SIZE, POOL_CONNECTIONS, MAX_RETRIES, BACKOFF_FACTOR, _session
+    with _session_lock:
+        if pool_size is not None: POOL_SIZE = pool_size
+        if pool_connections is not None: POOL_CONNECTIONS = pool_connections
+        if max_retries is not None: MAX_RETRIES = max_retries
+        if backoff_factor is not None: BACKOFF_FACTOR = backoff_factor
+        old_session, _session = _session, None # Следующий get_session() создаст сессию с новыми настройками
+    if old_session is not None:
+        old_session.close()
+
+def get(url, timeout=DEFAULT_TIMEOUT, **kwargs):
+    # Ограничение частоты и параллельности общее для всех запросов процесса к этому хосту.
+    # При stream=True слот занят до получения заголовков, тело читается уже без него
+    with throttle.request(urlsplit(url).hostname) as outcome:
+        response = get_session().get(url, timeout=timeout, **kwargs)
+        outcome.status = response.status_code
+        outcome.latency = response.elapsed.total_seconds() # Без времени чтения тела: страницы и изображения сравнимы
+        outcome.retry_after = retry_after_seconds(response.headers.get('Retry-After'))
+    return response
@@ -0,0 +1,177 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from PIL import Image
+
+# Обработка изображений для архива: уменьшение и перекодирование в WebP/JPEG.
+# Работает в пуле процессов, чтобы не упираться в GIL потоков Flask
+DEFAULT_PROCESS_WORKERS = os.cpu_count() or 1
+DEFAULT_QUALITY = 85
+OUTPUT_FORMATS = {'webp': ('WEBP', '.webp'), 'jpeg': ('JPEG', '.jpg'), 'jpg': ('JPEG', '.jpg')}
+
+# Сигнатуры форматов в начале файла; для определения формата больше ничего читать не нужно
+_SIGNATURES = (
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+    (b'BM', '.bmp'),
+)
+
+def sniff_image_format(header):
+    """Returns the file extension for the image format recognized from the
+    first bytes of the file, or None.
+    """
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return '.webp'
+    for signature, ext in _SIGNATURES:
+        if header.startswith(signature):
+            return ext
+    return None
+
+def normalize_options(options):
+    """Validates the processing options from a request. Returns None when no
+    processing was asked for and raises ValueError on bad values.
+    """
+    if not options: return None
+    max_width = options.get('max_width')
+    max_height = options.get('max_height')
+    output_format = (options.get('format') or '').lower() or None
+    quality = options.get('quality', DEFAULT_QUALITY)
+    for name, value in (('max_width', max_width), ('max_height', max_height)):
+        if value is not None and (not isinstance(value, int) or value <= 0):
+            raise ValueError(f"{name} должен быть положительным целым числом")
+    if output_format is not None and output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Неподдерживаемый формат: {output_format}")
+    if not isinstance(quality, int) or not 1 <= quality <= 100:
+        raise ValueError("quality должен быть от 1 до 100")
+    if max_width is None and max_height is None and output_format is None:
+        return None
+    return {'max_width': max_width, 'max_height': max_height, 'format': output_format, 'quality': quality}
+
+def process_image_file(src_path, dst_dir, dst_name, options):
+    """Resizes/re-encodes src_path and writes the result into dst_dir.
+    Runs in a worker process; returns the path of the written file.
+    """
+    with Image.open(src_path) as img:
+        source_format = img.format
+        if options['max_width'] or options['max_height']:
+            img.thumbnail((options['max_width'] or img.width, options['max_height'] or img.height))
+        if options['format']:
+            pil_format, ext = OUTPUT_FORMATS[options['format']]
+        else:
+            pil_format = source_format
+            ext = os.path.splitext(dst_name)[1]
+        if pil_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+            # В JPEG нет прозрачности: подкладываем белый фон
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            rgba = img.convert('RGBA')
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            img = background
+
+        base_name = os.path.splitext(dst_name)[0]
+        dst_path = os.path.join(dst_dir, base_name + ext)
+        suffix = 1
+        while os.path.exists(dst_path) and os.path.abspath(dst_path) != os.path.abspath(src_path):
+            dst_path = os.path.join(dst_dir, f"{base_name}_{suffix}{ext}")
+            suffix += 1
+        partial_path = dst_path + ".part"
+        save_options = {'quality': options['quality']} if pil_format in ('JPEG', 'WEBP') else {}
+        img.save(partial_path, format=pil_format, **save_options)
+    os.replace(partial_path, dst_path)
+    return dst_path
+
+_executor = None
+_executor_lock = threading.Lock()
+_pool_unavailable = False
+
+def _get_executor():
+    global _executor, _pool_unavailable
+    with _executor_lock:
+        if _executor is None and not _pool_unavailable:
+            try:
+                # spawn, как и в parse_pool: fork из многопоточного Flask может унаследовать захваченные блокировки
+                _executor = ProcessPoolExecutor(max_workers=DEFAULT_PROCESS_WORKERS, mp_context=get_context('spawn'))
+            except (OSError, NotImplementedError) as e:
+                # Например, в AWS Lambda нет /dev/shm для семафоров multiprocessing
+                print(f"Пул процессов недоступен, изображения обрабатываются в текущем процессе: {e}")
+                _pool_unavailable = True
+        return _executor
+
+def _broken(executor, e):
+    global _executor
+    print(f"Пул обработки изображений сломан ({e}), он будет создан заново")
+    with _executor_lock:
+        # Другой поток мог уже заменить пул: сбрасываем только сломанный
+        if _executor is executor: _executor = None
+
+def process_file(src_path, dst_dir, dst_name, options):
+    """Processes one file into dst_dir in the process pool and waits for it.
+    If a worker dies, the file is retried once in a new pool.
+    """
+    for attempt in range(2):
+        executor = _get_executor()
+        if executor is None:
+            return process_image_file(src_path, dst_dir, dst_name, options)
+        try:
+            return executor.submit(process_image_file, src_path, dst_dir, dst_name, options).result()
+        except BrokenProcessPool as e:
+            _broken(executor, e)
+            if attempt: raise
+
+def _run_in_pool(tasks, options):
+    # Задачи, оборвавшиеся из-за падения процесса (OOM, бомба распаковки в Pillow),
+    # повторяем один раз в новом пуле; в текущем процессе не пробуем, чтобы то же
+    # изображение не уронило сервер
+    results = [None] * len(tasks)
+    pending = list(range(len(tasks)))
+    for attempt in range(2):
+        executor = _get_executor()
+        if executor is None: return results if attempt else None
+        futures = []
+        for i in pending:
+            try:
+                futures.append((i, executor.submit(process_image_file, *tasks[i], options)))
+            except BrokenProcessPool as e: # Пул сломался еще до отправки задачи
+                futures.append((i, e))
+        pending = []
+        for i, future in futures:
+            try:
+                if isinstance(future, BrokenProcessPool): raise future
+                results[i] = future.result()
+            except BrokenProcessPool as e:
+                results[i] = e
+                pending.append(i)
+            except Exception as e:
+                results[i] = e
+        if not pending: break
+        _broken(executor, results[pending[0]])
+    return results
+
+def process_files(paths, options):
+    """Processes the image files in place in the process pool. The original
+    is replaced by the result (whose extension may change). Files that fail
+    to process are kept as they are.
+    """
+    tasks = [(path, os.path.dirname(path), os.path.basename(path)) for path in paths]
+    results = _run_in_pool(tasks, options)
+    if results is None:
+        results = []
+        for src, dst_dir, dst_name in tasks:
+            try:
+                results.append(process_image_file(src, dst_dir, dst_name, options))
+            except Exception as e:
+                results.append(e)
+
+    processed = []
+    for (src, _, _), result in zip(tasks, results):
+        if isinstance(result, Exception):
+            print(f"Ошибка обработки изображения {src}: {result}")
+            processed.append(src)
+            continue
+        if os.path.abspath(result) != os.path.abspath(src):
+            os.remove(src)
+        processed.append(result)
+    return processed
@@ -0,0 +1,181 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+import http_client
+import image_processing
+import metrics
+
+# Локальное хранилище изображений с адресацией по содержимому:
+# URL -> SHA-256 тела, каждый уникальный файл хранится один раз
+STORE_DIR = os.path.join(tempfile.gettempdir(), 'mono-uniparser-images')
+STORE_MAX_BYTES = 1024 * 1024 * 1024 # При превышении удаляются давно не использованные файлы
+URL_TTL = 24 * 3600 # Через сколько секунд URL скачивается заново (само содержимое может совпасть)
+# Загрузка идет по кускам прямо в файл, поэтому память на одно изображение не зависит от его размера
+MAX_IMAGE_BYTES = 20 * 1024 * 1024 # Ответ больше этого прерывается
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Типы, под которыми CDN иногда отдают изображения; такой ответ проверяется по сигнатуре первого куска
+_GENERIC_CONTENT_TYPES = ('', 'application/octet-stream', 'binary/octet-stream')
+
+_lock = threading.Lock()
+_initialized_dir = None
+
+class ImageRejected(Exception):
+    """The response is not an image or is larger than MAX_IMAGE_BYTES."""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+def configure(store_dir=None, max_bytes=None, url_ttl=None, max_image_bytes=None):
+    global STORE_DIR, STORE_MAX_BYTES, URL_TTL, MAX_IMAGE_BYTES
+    with _lock:
+        if store_dir is not None: STORE_DIR = store_dir
+        if max_bytes is not None: STORE_MAX_BYTES = max_bytes
+        if url_ttl is not None: URL_TTL = url_ttl
+        if max_image_bytes is not None: MAX_IMAGE_BYTES = max_image_bytes
+
+def _connect():
+    global _initialized_dir
+    if _initialized_dir != STORE_DIR:
+        os.makedirs(os.path.join(STORE_DIR, 'blobs'), exist_ok=True)
+    conn = sqlite3.connect(os.path.join(STORE_DIR, 'index.sqlite3'), timeout=30)
+    if _initialized_dir != STORE_DIR:
+        with _lock:
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS blobs (sha256 TEXT PRIMARY KEY, size INTEGER, last_used REAL)")
+                conn.execute("CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used)")
+                conn.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, sha256 TEXT, fetched_at REAL)")
+                conn.execute("CREATE INDEX IF NOT EXISTS urls_sha256 ON urls (sha256)")
+            _initialized_dir = STORE_DIR
+    return conn
+
+def blob_path(sha256):
+    return os.path.join(STORE_DIR, 'blobs', sha256[:2], sha256)
+
+def lookup(url):
+    """Returns (sha256, path) of the stored image for the URL, or None."""
+    with closing(_connect()) as conn, conn:
+        row = conn.execute("SELECT sha256, fetched_at FROM urls WHERE url = ?", (url,)).fetchone()
+        path = blob_path(row[0]) if row is not None and time.time() - row[1] <= URL_TTL else None
+        if path is None or not os.path.exists(path):
+            metrics.count('image_store_lookups_total', result='miss')
+            return None
+        sha256 = row[0]
+        conn.execute("UPDATE blobs SET last_used = ? WHERE sha256 = ?", (time.time(), sha256))
+    metrics.count('image_store_lookups_total', result='hit')
+    return sha256, path
+
+class BlobWriter:
+    """Writes an image into the store chunk by chunk. The blob is committed only
+    when the with-block finishes without an error.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.sha256 = None
+        self.size = 0
+        self._hash = hashlib.sha256()
+        os.makedirs(os.path.join(STORE_DIR, 'blobs'), exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=os.path.join(STORE_DIR, 'blobs'), suffix='.tmp')
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+        if exc_type is not None or self.size == 0:
+            os.remove(self._tmp_path)
+            return False
+        self.sha256 = self._hash.hexdigest()
+        path = blob_path(self.sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(self._tmp_path) # Такое содержимое уже есть: второй копии не храним
+        else:
+            os.replace(self._tmp_path, path)
+        now = time.time()
+        with closing(_connect()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO blobs (sha256, size, last_used) VALUES (?, ?, ?)", (self.sha256, self.size, now))
+            conn.execute("INSERT OR REPLACE INTO urls (url, sha256, fetched_at) VALUES (?, ?, ?)", (self.url, self.sha256, now))
+        _evict()
+        return False
+
+def _evict():
+    with closing(_connect()) as conn, conn:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total <= STORE_MAX_BYTES: return
+        target = STORE_MAX_BYTES * 0.9
+        for sha256, size in conn.execute("SELECT sha256, size FROM blobs ORDER BY last_used").fetchall():
+            if total <= target: break
+            try:
+                os.remove(blob_path(sha256))
+            except OSError:
+                pass
+            conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+            conn.execute("DELETE FROM urls WHERE sha256 = ?", (sha256,))
+            total -= size
+
+def _reject(reason, message):
+    metrics.count('image_rejected_total', reason=reason)
+    return ImageRejected(reason, message)
+
+class ImageBodyCheck:
+    """Checks an image response as it is read. Raises ImageRejected from the
+    constructor when Content-Type or Content-Length already rule the body out,
+    and from feed() as soon as the body turns out not to be an image or grows
+    past MAX_IMAGE_BYTES.
+    """
+
+    def __init__(self, headers):
+        self.content_type = headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if not self.content_type.startswith('image/') and self.content_type not in _GENERIC_CONTENT_TYPES:
+            raise _reject('content_type', f"Ответ не является изображением: {self.content_type}")
+        content_length = headers.get('Content-Length', '')
+        if content_length.isdigit() and int(content_length) > MAX_IMAGE_BYTES:
+            raise _reject('too_large', f"Изображение больше {MAX_IMAGE_BYTES} байт: {content_length}")
+        self.size = 0
+
+    def feed(self, chunk):
+        if self.size == 0 and self.content_type in _GENERIC_CONTENT_TYPES and image_processing.sniff_image_format(chunk) is None:
+            raise _reject('content_type', f"Ответ не является изображением ({self.content_type or 'тип не указан'})")
+        self.size += len(chunk)
+        if self.size > MAX_IMAGE_BYTES: # Content-Length может не быть (chunked) или он может быть неверным
+            raise _reject('too_large', f"Изображение больше {MAX_IMAGE_BYTES} байт")
+
+def iter_image_chunks(response):
+    """Yields the body of an image response (opened with stream=True) chunk by
+    chunk, checked with ImageBodyCheck.
+    """
+    check = ImageBodyCheck(response.headers)
+    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+        if not chunk: continue
+        check.feed(chunk)
+        yield chunk
+
+def fetch(url, timeout=http_client.DEFAULT_TIMEOUT):
+    """Returns (sha256, path) for the image, downloading it only when the store
+    has no fresh copy. Returns None for an empty body. The body goes straight
+    to disk; see iter_image_chunks for the checks that may raise ImageRejected.
+    """
+    cached = lookup(url)
+    if cached is not None: return cached
+    with http_client.get(url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        with BlobWriter(url) as writer:
+            try:
+                for chunk in iter_image_chunks(response):
+                    writer.write(chunk)
+            finally:
+                metrics.count('http_bytes_total', writer.size, kind='image')
+    if writer.sha256 is None: return None
+    return writer.sha256, blob_path(writer.sha256)
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import parser_logic
+import price_history
+from urls import normalize_url_slashes
+
+# Состояние прошлых обходов: хэши страниц и карточек каждого каталога
+STATE_DIR = os.path.join(tempfile.gettempdir(), 'mono-uniparser-incremental')
+
+_state_locks = {}
+_state_locks_guard = threading.Lock()
+
+def _hash(data):
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+def _product_hash(product):
+    return _hash(json.dumps(product, sort_keys=True, ensure_ascii=False))
+
+def _page_number(page_url):
+    match = re.search(r'PAGEN_1=(\d+)', page_url)
+    return int(match.group(1)) if match else 1
+
+def _state_path(url):
+    return os.path.join(STATE_DIR, _hash(normalize_url_slashes(url)) + '.json')
+
+def _state_lock(path):
+    # Два одновременных инкрементальных обхода одного каталога не должны перетирать состояние друг друга
+    with _state_locks_guard:
+        return _state_locks.setdefault(path, threading.Lock())
+
+def _load_state(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'pages': {}}
+
+def _save_state(path, state):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=STATE_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def parse_catalog_incremental(url, max_workers=parser_logic.DEFAULT_PAGE_WORKERS):
+    """Re-crawls a catalog and returns only what changed since the previous
+    crawl of the same URL: added, removed and changed products.
+
+    Pages whose catalog subtree hashes the same as last time are not
+    re-parsed; their products are taken from the stored state. Returns None
+    when the first page fails; the stored state is then left as it was.
+    """
+    path = _state_path(url)
+    with _state_lock(path):
+        old_pages = _load_state(path)['pages']
+        new_pages = {}
+        lock = threading.Lock()
+        skipped, parsed = [], []
+
+        def extract_products(site, page_url, soup, site_root_url):
+            page_hash = _hash(str(soup))
+            old_page = old_pages.get(page_url)
+            if old_page and old_page['hash'] == page_hash:
+                products = old_page['products']
+                product_hashes = old_page['product_hashes']
+                with lock: skipped.append(page_url)
+            else:
+                products = parser_logic.extract_catalog_products(site, page_url, soup, site_root_url)
+                product_hashes = {p['link']: _product_hash(p) for p in products}
+                with lock: parsed.append(page_url)
+            with lock:
+                new_pages[page_url] = {'hash': page_hash, 'products': products, 'product_hashes': product_hashes}
+            return products
+
+        total_items = total_pages = end_page = 0
+        for batch in parser_logic.iter_catalog(url, max_workers=max_workers, extract_products=extract_products):
+            total_items, total_pages = batch["totalItems"], batch["totalPages"]
+            end_page = batch["page"] # Не загрузившиеся страницы тоже приходят, с пустым списком товаров
+        if not new_pages:
+            # Первая страница не загрузилась: сравнивать не с чем, состояние не трогаем
+            return None
+
+        # Страницы прошлого обхода, которые сейчас не загрузились (ошибка сети в любом месте каталога),
+        # переносим как есть, чтобы их товары не считались удаленными. Граница — число страниц с
+        # первой страницы; если же обход остановился раньше (сайт сообщил о конце каталога или
+        # повторил страницу), страницы после остановки считаем исчезнувшими.
+        last_page = end_page if end_page < total_pages else total_pages
+        for page_url, old_page in old_pages.items():
+            if page_url not in new_pages and _page_number(page_url) <= last_page:
+                new_pages[page_url] = old_page
+
+        old_products = {p['link']: p for page in old_pages.values() for p in page['products']}
+        old_hashes = {link: h for page in old_pages.values() for link, h in page['product_hashes'].items()}
+        new_products = {p['link']: p for page in new_pages.values() for p in page['products']}
+        new_hashes = {link: h for page in new_pages.values() for link, h in page['product_hashes'].items()}
+
+        added, changed = [], []
+        unchanged = 0
+        for link, product in new_products.items():
+            old_product = old_products.get(link)
+            if old_product is None:
+                added.append(product)
+            elif old_hashes.get(link) != new_hashes.get(link):
+                changed.append({
+                    "link": link,
+                    "name": product.get("name"),
+                    "price": product.get("price"),
+                    "old_price": product.get("old_price"),
+                    "previous_price": old_product.get("price"),
+                    "previous_old_price": old_product.get("old_price"),
+                    "product": product,
+                })
+            else:
+                unchanged += 1
+        removed = [product for link, product in old_products.items() if link not in new_products]
+
+        _save_state(path, {'url': url, 'pages': new_pages})
+
+    # Повторный обход — основной способ следить за ценами: новые и изменившиеся товары попадают в историю цен
+    price_history.record(added + [change["product"] for change in changed])
+
+    return {
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+        "unchanged": unchanged,
+        "totalItems": total_items,
+        "pagesSkipped": len(skipped),
+        "pagesParsed": len(parsed),
+    }
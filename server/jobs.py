@@ -0,0 +1,293 @@
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from parser_logic import iter_catalog
+from archiver import create_zip_archive
+import crawler
+import price_history
+
+# Фоновые задачи: долгий парсинг каталога и сборка архива выполняются вне HTTP-запроса
+DEFAULT_JOB_WORKERS = 2
+JOBS_DB_PATH = os.path.join(tempfile.gettempdir(), 'mono-uniparser-jobs.sqlite3')
+JOB_RETENTION = 24 * 3600 # Секунд, сколько хранятся завершенные задачи и их архивы
+SWEEP_INTERVAL = 3600 # Не чаще раза в столько секунд удаляем устаревшие задачи
+
+_UNFINISHED = ('queued', 'running')
+_FINISHED = ('done', 'failed')
+
+class SQLiteJobStore:
+    """Keeps jobs in a SQLite file, so every worker process of the server sees them."""
+
+    def __init__(self, path=JOBS_DB_PATH):
+        self.path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, "
+                "progress TEXT, result TEXT, error TEXT, created_at REAL, updated_at REAL, owner TEXT)"
+            )
+            # База, созданная до появления колонки owner
+            if 'owner' not in [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, updated_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def create(self, job_id, kind, owner=None):
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, progress, created_at, updated_at, owner) VALUES (?, ?, 'queued', '{}', ?, ?, ?)",
+                (job_id, kind, now, now, owner),
+            )
+
+    def update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        for name in ('progress', 'result'):
+            if name in fields: fields[name] = json.dumps(fields[name], ensure_ascii=False)
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None: return None
+        return self._decode(dict(row))
+
+    @staticmethod
+    def _decode(job):
+        for name in ('progress', 'result'):
+            job[name] = json.loads(job[name]) if job[name] else None
+        return job
+
+    def unfinished(self):
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(f"SELECT * FROM jobs WHERE status IN {_UNFINISHED}").fetchall()
+        return [self._decode(dict(row)) for row in rows]
+
+    def expired(self, before):
+        """Finished jobs last updated before the unix time `before`."""
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(f"SELECT * FROM jobs WHERE status IN {_FINISHED} AND updated_at < ?", (before,)).fetchall()
+        return [self._decode(dict(row)) for row in rows]
+
+    def delete(self, job_id):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+class FileJobStore:
+    """Keeps every job as a JSON file in a directory."""
+
+    def __init__(self, directory=os.path.join(tempfile.gettempdir(), 'mono-uniparser-jobs')):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _write(self, job):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(job['id']))
+
+    def create(self, job_id, kind, owner=None):
+        now = time.time()
+        self._write({"id": job_id, "kind": kind, "status": "queued", "progress": {}, "result": None,
+                     "error": None, "created_at": now, "updated_at": now, "owner": owner})
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self.get(job_id)
+            job.update(fields, updated_at=time.time())
+            self._write(job)
+
+    def get(self, job_id):
+        try:
+            with open(self._path(job_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _all(self):
+        jobs = (self.get(name[:-len('.json')]) for name in os.listdir(self.directory) if name.endswith('.json'))
+        return [job for job in jobs if job is not None]
+
+    def unfinished(self):
+        return [job for job in self._all() if job['status'] in _UNFINISHED]
+
+    def expired(self, before):
+        return [job for job in self._all() if job['status'] in _FINISHED and job['updated_at'] < before]
+
+    def delete(self, job_id):
+        try:
+            os.remove(self._path(job_id))
+        except OSError:
+            pass
+
+def _run_parse_catalog(job_id, payload):
+    products = []
+    total_items = 0
+    for batch in iter_catalog(payload['url'], show_all=payload.get('show_all', False)):
+        products.extend(batch["products"])
+        total_items = batch["totalItems"]
+        _store.update(job_id, progress={"page": batch["page"], "totalPages": batch["totalPages"], "productsCount": len(products)})
+    if not products:
+        raise Exception("Ошибка парсинга каталога или товары не найдены")
+    price_history.record(products)
+    return {"products": products, "totalItems": total_items}
+
+def _run_archive(job_id, payload):
+    last_update = [0.0]
+    def progress(done, total):
+        # Не пишем в хранилище на каждое изображение: достаточно пары обновлений в секунду
+        if done < total and time.monotonic() - last_update[0] < 0.5: return
+        last_update[0] = time.monotonic()
+        _store.update(job_id, progress={"imagesDone": done, "imagesTotal": total})
+    archive_path = create_zip_archive(payload['products_data'], progress=progress, processing=payload.get('processing'))
+    # Загруженные изображения уже в архиве: до удаления задачи на диске остается только он
+    archive_dir = os.path.dirname(archive_path)
+    for name in os.listdir(archive_dir):
+        if os.path.isdir(os.path.join(archive_dir, name)):
+            shutil.rmtree(os.path.join(archive_dir, name), ignore_errors=True)
+    return {"archive_path": archive_path}
+
+def _run_crawl(job_id, payload):
+    # crawl_id задачи сохраняется сразу: по нему можно возобновить прерванный обход новой задачей
+    crawl_id = payload.get('crawl_id') or job_id
+    last_update = [0.0]
+    def progress(state):
+        if state["pagesQueued"] and time.monotonic() - last_update[0] < 0.5: return
+        last_update[0] = time.monotonic()
+        _store.update(job_id, progress={"crawlId": crawl_id, **state})
+    result = crawler.crawl(payload.get('seeds') or [], payload.get('discover') or [], crawl_id=crawl_id, progress=progress)
+    price_history.record(result['products'])
+    return result
+
+JOB_HANDLERS = {
+    'parse_catalog': _run_parse_catalog,
+    'archive': _run_archive,
+    'crawl': _run_crawl,
+}
+
+_store = None
+_executor = None
+_setup_lock = threading.Lock()
+_last_sweep = None
+_recovered_store = None # Хранилище, в котором уже проверены задачи остановившихся процессов
+
+def configure(store=None, max_workers=None):
+    """Replaces the job store and/or the size of the worker pool."""
+    global _store, _executor
+    with _setup_lock:
+        if store is not None: _store = store
+        if max_workers is not None:
+            if _executor is not None: _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+
+def _owner():
+    # Процесс, выполняющий задачу. pid берем при создании задачи, а не при импорте:
+    # воркеры gunicorn --preload импортируют модуль еще в мастер-процессе
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _owner_alive(owner):
+    host, _, pid = (owner or '').rpartition(':')
+    if not pid.isdigit(): return False # Задача записана до появления владельца
+    if host != socket.gethostname() or os.name == 'nt':
+        return True # О процессах другой машины (и на Windows, где os.kill(pid, 0) шлет Ctrl+C) судить не можем
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def recover():
+    """Marks queued/running jobs whose process is gone as failed: nobody
+    will ever finish them. Jobs of live worker processes are left alone.
+    """
+    for job in _store.unfinished():
+        if not _owner_alive(job.get('owner')):
+            _store.update(job['id'], status='failed', error="Процесс сервера остановился, задача не завершена")
+
+def _remove_archive(archive_path):
+    if not archive_path: return
+    archive_dir = os.path.dirname(archive_path)
+    if os.path.abspath(archive_dir) == os.path.abspath(tempfile.gettempdir()):
+        archive_dir = None # Архив не в своей временной папке: удаляем только файл
+    try:
+        if archive_dir: shutil.rmtree(archive_dir)
+        else: os.remove(archive_path)
+    except OSError:
+        pass
+
+def sweep(now=None):
+    """Deletes jobs finished more than JOB_RETENTION seconds ago together with
+    their archives.
+    """
+    for job in _store.expired((now or time.time()) - JOB_RETENTION):
+        if job['kind'] == 'archive' and job['result']:
+            _remove_archive(job['result'].get('archive_path'))
+        _store.delete(job['id'])
+
+def _maybe_sweep():
+    global _last_sweep
+    with _setup_lock:
+        if _last_sweep is not None and time.monotonic() - _last_sweep < SWEEP_INTERVAL: return
+        _last_sweep = time.monotonic()
+    try:
+        sweep()
+    except (OSError, sqlite3.Error) as e:
+        print(f"Ошибка удаления устаревших задач: {e}")
+
+def _ensure_started():
+    global _store, _executor, _recovered_store
+    with _setup_lock:
+        if _store is None: _store = SQLiteJobStore()
+        if _executor is None: _executor = ThreadPoolExecutor(max_workers=DEFAULT_JOB_WORKERS, thread_name_prefix='job')
+        # Задачи процессов, остановившихся до запуска этого, проверяем один раз на хранилище
+        needs_recovery = _recovered_store is not _store
+        _recovered_store = _store
+    if needs_recovery:
+        try:
+            recover()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Ошибка проверки незавершенных задач: {e}")
+    _maybe_sweep()
+
+def _run(job_id, kind, payload):
+    _store.update(job_id, status='running')
+    try:
+        result = JOB_HANDLERS[kind](job_id, payload)
+        _store.update(job_id, status='done', result=result)
+    except Exception as e:
+        print(f"Ошибка выполнения задачи {kind} {job_id}: {e}")
+        _store.update(job_id, status='failed', error=str(e))
+
+def submit(kind, payload):
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Неизвестный тип задачи: {kind}")
+    _ensure_started()
+    job_id = uuid.uuid4().hex
+    _store.create(job_id, kind, owner=_owner())
+    _executor.submit(_run, job_id, kind, payload)
+    return job_id
+
+def get_job(job_id):
+    _ensure_started()
+    return _store.get(job_id)
@@ -0,0 +1,185 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Счетчики и таймеры этапов горячего пути: загрузка, разбор HTML, извлечение карточек,
+# скачивание изображений, запись ZIP. Значения живут в памяти процесса и отдаются
+# в текстовом формате Prometheus (/metrics); у каждого воркера сервера они свои.
+PREFIX = 'uniparser_'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    'stage_seconds': ('histogram', 'Time spent in a hot-path stage'),
+    'http_bytes_total': ('counter', 'Bytes received from the shops, by kind of resource'),
+    'http_cache_requests_total': ('counter', 'Page cache lookups, by result'),
+    'result_cache_requests_total': ('counter', 'Parse result cache lookups: hit, miss or coalesced with a running parse'),
+    'image_store_lookups_total': ('counter', 'Image store lookups, by result'),
+    'image_rejected_total': ('counter', 'Image downloads aborted: not an image or too large'),
+    'errors_total': ('counter', 'Errors by site and stage'),
+    'http_throttled_total': ('counter', 'Responses with 429/503 from a host'),
+    'host_concurrency_limit': ('gauge', 'Current adaptive limit of concurrent requests to a host'),
+}
+
+_lock = threading.Lock()
+_counters = {} # (имя, метки) -> значение
+_gauges = {}
+_histograms = {} # (имя, метки) -> [счетчики корзин..., сумма, количество]
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+class RequestTimings:
+    """Per-request breakdown: seconds and calls per stage, plus counters."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage, seconds):
+        with self._lock:
+            total, calls = self.stages.get(stage, (0.0, 0))
+            self.stages[stage] = (total + seconds, calls + 1)
+
+    def add_counter(self, name, labels, value):
+        label = ",".join(f"{k}={v}" for k, v in sorted(labels.items()))
+        key = f"{name}{{{label}}}" if label else name
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "totalSeconds": round(time.perf_counter() - self.started, 4),
+                "stages": {stage: {"seconds": round(total, 4), "calls": calls} for stage, (total, calls) in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+    def server_timing(self):
+        """Value for the Server-Timing response header."""
+        with self._lock:
+            return ", ".join(f"{stage};dur={total * 1000:.1f}" for stage, (total, _) in self.stages.items())
+
+_current = contextvars.ContextVar('metrics_request_timings', default=None)
+_recording = contextvars.ContextVar('metrics_recording', default=None)
+
+def start_request():
+    """Starts collecting a breakdown for the current request; returns (timings, token)."""
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+def end_request(token):
+    _current.reset(token)
+
+def current():
+    return _current.get()
+
+def bind(func):
+    """Wraps func so that calls from pool threads still report into the
+    breakdown of the request that created the wrapper.
+    """
+    context = contextvars.copy_context()
+    def wrapper(*args, **kwargs):
+        # Один Context нельзя войти из двух потоков сразу, поэтому каждый вызов работает в своей копии
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+@contextmanager
+def record():
+    """Collects the counters and stage times reported inside the block into a
+    list of events, so another process can apply them with replay()
+    (see parse_pool).
+    """
+    events = []
+    token = _recording.set(events)
+    try:
+        yield events
+    finally:
+        _recording.reset(token)
+
+def replay(events):
+    for kind, name, value, labels in events:
+        if kind == 'stage': add_stage_time(name, value)
+        else: count(name, value, **labels)
+
+def count(name, value=1, **labels):
+    events = _recording.get()
+    if events is not None: events.append(('count', name, value, labels))
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    timings = _current.get()
+    if timings is not None: timings.add_counter(name, labels, value)
+
+def gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        values = _histograms.get(key)
+        if values is None:
+            values = _histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound: values[i] += 1
+        values[-2] += seconds
+        values[-1] += 1
+
+def add_stage_time(name, seconds):
+    events = _recording.get()
+    if events is not None: events.append(('stage', name, seconds, None))
+    observe('stage_seconds', seconds, stage=name)
+    timings = _current.get()
+    if timings is not None: timings.add_stage(name, seconds)
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_time(name, time.perf_counter() - start)
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs: return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+def render():
+    """Returns all metrics in the Prometheus text exposition format."""
+    with _lock:
+        counters = sorted([*_counters.items(), *_gauges.items()])
+        histograms = sorted((key, list(values)) for key, values in _histograms.items())
+
+    lines = []
+    described = set()
+    def describe(name):
+        if name in described: return
+        described.add(name)
+        metric_type, help_text = HELP.get(name, ('untyped', name))
+        lines.append(f"# HELP {PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}{name} {metric_type}")
+
+    for (name, labels), value in counters:
+        describe(name)
+        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+    for (name, labels), values in histograms:
+        describe(name)
+        for bound, bucket_count in zip(BUCKETS, values):
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', bound)])} {bucket_count}")
+        lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {values[-1]}")
+        lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {values[-2]}")
+        lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {values[-1]}")
+    return "\n".join(lines) + "\n"
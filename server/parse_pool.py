@@ -0,0 +1,111 @@
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+import metrics
+import sites
+
+# Разбор HTML в пуле процессов: BeautifulSoup — чистый Python и упирается в GIL,
+# а процессы дают по ядру на страницу. В пул уходят только HTML страницы и ее URL,
+# обратно приходят готовые словари товаров. Процессы запускаются один раз и
+# переиспользуются, поэтому импорт lxml и компиляция селекторов не повторяются.
+PROCESSES = 0 # 0 — разбор в вызывающем потоке, без пула
+START_METHOD = 'spawn' # fork из многопоточного Flask может унаследовать захваченные блокировки
+
+_executor = None
+_executor_lock = threading.Lock()
+_pool_unavailable = False
+
+def configure(processes=None):
+    """Sets the number of parser processes (0 turns the pool off). The running
+    pool is replaced, so the new workers also pick up adapters registered since.
+    """
+    global PROCESSES, _pool_unavailable
+    with _executor_lock:
+        if processes is not None: PROCESSES = processes
+        _pool_unavailable = False
+    shutdown()
+
+def enabled():
+    return PROCESSES > 0 and not _pool_unavailable
+
+def _init_worker(site_roots):
+    # Адаптеры, перенастроенные в родителе (например, на локальный сервер в benchmarks/run.py)
+    import copy
+    import parser_logic # noqa: F401 — импорт и прогрев заранее, а не в первой задаче
+    for name, domain, root_url in site_roots:
+        adapter = sites.SITES_BY_NAME.get(name)
+        if adapter is None or (adapter.domain, adapter.root_url) == (domain, root_url): continue
+        local = copy.copy(adapter)
+        local.domain, local.root_url = domain, root_url
+        sites.register(local)
+
+def _warm_up():
+    return None
+
+def _run_in_worker(func, args):
+    # Счетчики и время этапов воркера возвращаются вместе с результатом и учитываются в родителе
+    with metrics.record() as events:
+        result = func(*args)
+    return result, events
+
+def _get_executor():
+    global _executor, _pool_unavailable
+    with _executor_lock:
+        if _executor is None and PROCESSES > 0 and not _pool_unavailable:
+            site_roots = [(adapter.name, adapter.domain, adapter.root_url) for adapter in sites.SITES]
+            try:
+                _executor = ProcessPoolExecutor(max_workers=PROCESSES, mp_context=get_context(START_METHOD),
+                                                initializer=_init_worker, initargs=(site_roots,))
+            except (OSError, NotImplementedError) as e:
+                print(f"Пул процессов недоступен, HTML разбирается в текущем процессе: {e}")
+                _pool_unavailable = True
+        return _executor
+
+def start():
+    """Starts all worker processes now instead of on the first pages."""
+    executor = _get_executor()
+    if executor is None: return
+    for future in [executor.submit(_warm_up) for _ in range(PROCESSES)]:
+        future.result()
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def _broken(e):
+    global _executor
+    print(f"Пул разбора HTML сломан ({e}), он будет создан заново")
+    with _executor_lock:
+        _executor = None
+
+def run(func, *args):
+    """Calls func(*args) in a parser process and returns its result. func and
+    the arguments must be picklable (module-level functions, strings, dicts).
+    Without the pool, or if a worker died, func runs right here.
+    """
+    executor = _get_executor()
+    if executor is not None:
+        try:
+            result, events = executor.submit(_run_in_worker, func, args).result()
+            metrics.replay(events)
+            return result
+        except BrokenProcessPool as e:
+            _broken(e)
+    return func(*args)
+
+async def run_async(func, *args):
+    """run() for asyncio code: awaits the worker without blocking the loop."""
+    executor = _get_executor()
+    if executor is not None:
+        try:
+            result, events = await asyncio.wrap_future(executor.submit(_run_in_worker, func, args))
+            metrics.replay(events)
+            return result
+        except BrokenProcessPool as e:
+            _broken(e)
+    return await asyncio.to_thread(func, *args)
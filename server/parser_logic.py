@@ -1,403 +1,343 @@
 import requests
 from bs4 import BeautifulSoup
 import re
-
-def _normalize_url_slashes(url):
-    """Replaces multiple slashes with a single slash in the URL path,
-    preserving http:// or https://.
-    """
-    if '://' in url:
-        protocol, rest = url.split('://', 1)
-        # Split by the first slash after protocol to keep domain part separate
-        if '/' in rest:
-            domain, path = rest.split('/', 1)
-            # Remove redundant slashes in the path part and then strip any leading slashes
-            normalized_path = re.sub(r'/{2,}', '/', path).lstrip('/')
-            return f"{protocol}://{domain}/{normalized_path}"
-        else:
-            return url # No path, nothing to normalize
-    else:
-        # If no protocol, just replace double slashes
-        return re.sub(r'/{2,}', '/', url)
-
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import http_cache
+import metrics
+import parse_pool
+import sites
+from urls import normalize_url_slashes as _normalize_url_slashes
+
+# Сколько страниц пагинации каталога загружается параллельно
+DEFAULT_PAGE_WORKERS = 4
+# Сколько карточек товаров парсится параллельно при пакетном обогащении
+DEFAULT_PRODUCT_WORKERS = 8
+# Параметр Bitrix, выводящий весь каталог одной страницей. Если в компоненте это
+# не разрешено, сайт его игнорирует и отдает обычную первую страницу
+SHOW_ALL_PARAM = 'SHOWALL_1=1'
+
+# Бэкенд BeautifulSoup: lxml заметно быстрее встроенного html.parser, если он установлен
+try:
+    import lxml # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+# Шаблоны разбора названия товара компилируются один раз при импорте
+_BRAND_RE = re.compile(r'\b([A-ZА-Я]{2,})\b')
+_YEAR_RE = re.compile(r'\(?(\d{4})\)?\s*г?\.')
+# Сколько разных названий и брендов держать в памяти; в каталоге названия часто повторяются
+TITLE_CACHE_SIZE = 4096
+BRAND_CACHE_SIZE = 256
+
+@lru_cache(maxsize=BRAND_CACHE_SIZE)
+def _model_pattern(brand):
+    # Бренд экранируется: символы вроде "+" или "(" в названии не должны ломать шаблон
+    return re.compile(rf'{re.escape(brand)}\s+(.*?)\s+\(?\d{{4}}')
+
+@lru_cache(maxsize=TITLE_CACHE_SIZE)
 def parse_vehicle_description(description):
-    brand_match = re.search(r'\b([A-ZА-Я]{2,})\b', description)
+    brand_match = _BRAND_RE.search(description)
     brand = brand_match.group(1) if brand_match else ""
-    model_pattern = re.compile(rf'{brand}\s+(.*?)\s+\(?\d{{4}}')
-    model_match = model_pattern.search(description)
+    model_match = _model_pattern(brand).search(description)
     model = model_match.group(1).strip() if model_match else ""
-    year_match = re.search(r'\(?(\d{4})\)?\s*г?\.', description)
+    year_match = _YEAR_RE.search(description)
     year = year_match.group(1) if year_match else ""
     return brand, model, year
 
-def _fetch_page(url):
-    response = requests.get(url, timeout=10)
-    response.raise_for_status() # Вызывает исключение для плохих статусов HTTP
-    return BeautifulSoup(response.text, 'html.parser')
-
-def _parse_rollingmoto_catalog(soup, site_root_url):
-    products_data = []
-    products_on_page = soup.find_all('div', class_='catalog_item_wrapp')
-
-    for product in products_on_page:
-        try:
-            product_title = product.find('a', class_="dark_link js-notice-block__title option-font-bold font_sm")
-            if not product_title: continue
-
-            product_link = site_root_url + product_title.get('href').lstrip('/')
-            product_link = _normalize_url_slashes(product_link)
-            product_name = product_title.find('span').text.strip() if product_title.find('span') else ""
-            product_brand, product_model, product_year = parse_vehicle_description(product_name)
-
-            product_info = product.find('div', class_='cost prices clearfix')
-            if not product_info: continue
-
-            images = []
-            for link in product_info.find_all('link'):
-                if 'schema.org' in link.get('href'): continue
-                img_url = link.get('href')
-                if img_url and not img_url.startswith('http'):
-                    img_url = site_root_url + img_url.lstrip('/')
-                if img_url: images.append(img_url)
-
-            description = ""
-            meta_desc = [meta for meta in product_info.find_all('meta') if meta.get('itemprop') == 'description']
-            if meta_desc: description = meta_desc[0].get('content', '')
-
-            price_value = product_info.find('span', class_='price_value').text.strip() if product_info.find('span', class_='price_value') else "N/A"
-            price_discount = None
-            sale_value = None
-            inner_sale = None
-
-            if product_info.find('div', class_='price discount'):
-                price_discount_tag = product_info.find('div', class_='price discount').find('span')
-                price_discount = price_discount_tag.text.strip() if price_discount_tag else None
-
-                sale_block = product_info.find('div', class_='sale_block')
-                sale_value_tag = sale_block.find('span') if sale_block else None
-                sale_value = sale_value_tag.text.strip() if sale_value_tag else None
-
-                inner_sale_div = product_info.find('div', class_='inner-sale')
-                inner_sale_tag = inner_sale_div.find('span') if inner_sale_div else None
-                inner_sale = inner_sale_tag.text.strip() if inner_sale_tag else None
-
-            products_data.append({
-                "brand": product_brand,
-                "model": product_model,
-                "year": product_year,
-                "name": product_name,
-                "link": product_link,
-                "images": images,
-                "description": description,
-                "price": price_value,
-                "old_price": price_discount,
-                "discount": sale_value,
-                "economy": inner_sale,
-                "site": "rollingmoto"
-            })
-        except Exception as e:
-            print(f"Ошибка парсинга товара Rollingmoto: {e}")
-            continue
-    return products_data
-
-def _parse_motoland_catalog(soup, site_root_url):
-    products_data = []
-    catalog_block = soup.find('div', class_='catalog-block')
-    if not catalog_block: return []
+def parse_vehicle_descriptions(descriptions):
+    """Batch form of parse_vehicle_description: returns a (brand, model, year)
+    tuple for every product name, in the same order. Repeated names are
+    parsed once.
+    """
+    return [parse_vehicle_description(description or "") for description in descriptions]
+
+def _fetch_html(url):
+    with metrics.stage('fetch'):
+        response = http_cache.get(url, timeout=10)
+        response.raise_for_status() # Вызывает исключение для плохих статусов HTTP
+        return response.text
+
+def _parse_html(func, *args, in_pool=True):
+    """Runs one of the HTML parsers below in a parser process when parse_pool
+    is enabled. Custom extract_products callbacks (closures, as in
+    incremental.py) cannot be sent to another process: pass in_pool=False.
+    """
+    if in_pool and parse_pool.enabled():
+        return parse_pool.run(func, *args)
+    return func(*args)
+
+def _make_soup(html, parse_only=None):
+    # parse_only строит дерево только из нужных парсеру элементов, остальная разметка пропускается
+    with metrics.stage('parse'):
+        return BeautifulSoup(html, HTML_PARSER, parse_only=parse_only)
+
+# Поля товара в ответе API; то, что сайт не объявил, остается значением по умолчанию
+_PRODUCT_DEFAULTS = (
+    ("brand", ""), ("model", ""), ("year", ""), ("name", ""), ("link", ""), ("images", []), ("description", ""),
+    ("price", "N/A"), ("old_price", None), ("discount", None), ("economy", None),
+)
+
+def _build_product(site, fields, extra=None, description=None):
+    if description is None:
+        description = parse_vehicle_description(fields.get("name") or "")
+    product_brand, product_model, product_year = description
+    product = {key: fields.get(key, default) for key, default in _PRODUCT_DEFAULTS}
+    product.update(brand=product_brand, model=product_model, year=product_year)
+    if extra: product.update(extra)
+    product["site"] = site.name
+    return product
+
+def _parse_catalog_cards(site, cards, site_root_url):
+    with metrics.stage('extract'):
+        card_fields = []
+        for card in cards:
+            try:
+                # Каждый скомпилированный селектор сайта выполняется по карточке один раз
+                fields = {}
+                if not sites.extract_fields(site.card_fields, card, site_root_url, fields): continue
+                card_fields.append(fields)
+            except Exception as e:
+                print(f"Ошибка парсинга товара {site.title}: {e}")
+                metrics.count('errors_total', site=site.name, stage='card')
+                continue
+        # Названия всей страницы разбираем одним пакетом
+        descriptions = parse_vehicle_descriptions(fields.get("name") for fields in card_fields)
+        return [_build_product(site, fields, description=description) for fields, description in zip(card_fields, descriptions)]
+
+def extract_catalog_products(site, page_url, soup, site_root_url):
+    """Default card extraction for a fetched catalog page. parse_catalog
+    accepts a replacement with the same signature (see incremental.py).
+    """
+    adapter = sites.SITES_BY_NAME.get(site)
+    if adapter is None: return []
+    return _parse_catalog_cards(adapter, adapter.find_cards(soup) or [], site_root_url)
 
-    product_cards = catalog_block.find_all('div', class_='grid-list__item')
+def _parse_catalog_page(site, page_num, current_url, site_root_url, extract_products):
+    """Loads one pagination page. Returns None when the catalog has ended
+    and an empty list when the page failed and should be skipped.
+    """
+    try:
+        html = _fetch_html(current_url)
+    except requests.exceptions.RequestException as e:
+        print(f"Ошибка сети или HTTP при загрузке страницы {page_num}: {e}. Пропускаем.")
+        metrics.count('errors_total', site=site, stage='catalog_fetch')
+        return []
+    return _parse_html(_parse_catalog_html, site, page_num, current_url, html, site_root_url, extract_products,
+                       in_pool=extract_products is extract_catalog_products)
+
+def _parse_catalog_html(site, page_num, current_url, html, site_root_url, extract_products):
+    adapter = sites.SITES_BY_NAME[site]
+    try:
+        soup = _make_soup(html, parse_only=adapter.catalog_parse_only)
+
+        products_on_page = adapter.find_cards(soup)
+        if products_on_page is None:
+            print(f"Блок каталога на странице {adapter.title} {page_num} не найден. Предполагается конец.")
+            return None
+        if not products_on_page:
+            print(f"На странице {adapter.title} {page_num} товары не найдены. Предполагается конец каталога.")
+            return None
+        return extract_products(site, current_url, soup, site_root_url) # Передаем site_root_url
+    except Exception as e:
+        print(f"Ошибка парсинга страницы {page_num}: {e}. Пропускаем.")
+        metrics.count('errors_total', site=site, stage='catalog_parse')
+    return []
 
-    for product_card in product_cards:
-        try:
-            product_title_div = product_card.find('div', class_='catalog-block__info-title')
-            if not product_title_div: continue
-
-            product_link_tag = product_title_div.find('a')
-            if not product_link_tag: continue
-
-            product_link = site_root_url + product_link_tag.get('href').lstrip('/')
-            product_link = _normalize_url_slashes(product_link)
-            product_name = product_title_div.find('span').text.strip() if product_title_div.find('span') else product_link_tag.text.strip()
-
-            product_brand, product_model, product_year = parse_vehicle_description(product_name)
-
-            images = []
-            image_list_link = product_card.find('a', class_='image-list__link')
-            if image_list_link:
-                product_images_tags = image_list_link.find_all('img')
-                for image_tag in product_images_tags:
-                    img_url = image_tag.get('data-src')
-                    if img_url and not img_url.startswith('http'):
-                        img_url = site_root_url + img_url.lstrip('/')
-                    if img_url: images.append(img_url)
-
-            price_value = "N/A"
-            price_meta_tag = product_card.find('meta', itemprop='price')
-            if price_meta_tag:
-                price_value = price_meta_tag.get('content', "N/A")
-
-            products_data.append({
-                "brand": product_brand,
-                "model": product_model,
-                "year": product_year,
-                "name": product_name,
-                "link": product_link,
-                "images": images,
-                "description": "",
-                "price": price_value,
-                "old_price": None,
-                "discount": None,
-                "economy": None,
-                "site": "motoland",
-            })
-        except Exception as e:
-            print(f"Ошибка парсинга товара Motoland: {e}")
-            continue
-    return products_data
-
-def parse_catalog(url):
+def catalog_page_url(url, page_num, show_all=False):
+    """URL of the page_num-th pagination page of the catalog."""
     url = _normalize_url_slashes(url) # Нормализуем входящий URL
+    if page_num == 1:
+        if show_all:
+            return f"{url}{'&' if '?' in url else '?'}{SHOW_ALL_PARAM}"
+        return url # Используем исходный URL для первой страницы
     pagination_base_url = url.split('?')[0] # Базовый URL для пагинации (например, https://www.rollingmoto.ru/catalog/mototekhnika/)
-    products_data = []
-    page_num = 1
-    items_per_page = 20 # Значение по умолчанию, может быть уточнено после первой страницы
+    return _normalize_url_slashes(f"{pagination_base_url}?PAGEN_1={page_num}")
+
+def same_products(products, other_products):
+    """True when two catalog pages list the same products. Bitrix answers an
+    out-of-range PAGEN_1 with the last page again, so a repeat means the
+    catalog has ended.
+    """
+    return bool(products) and {p['link'] for p in products} == {p['link'] for p in other_products}
 
-    site = 'unknown'
-    site_root_url = '' # Новая переменная для корневого URL сайта
+def parse_first_catalog_page(url, extract_products=extract_catalog_products, show_all=False):
+    """Parses the first page of a catalog and works out its size.
+    Returns (site, total_items, total_pages, products), or None for an
+    unknown site or a failed first page.
 
-    if 'rollingmoto.ru' in url:
-        site = 'rollingmoto'
-        site_root_url = 'https://www.rollingmoto.ru/'
-    elif 'motoland-shop.ru' in url:
-        site = 'motoland'
-        site_root_url = 'https://motoland-shop.ru/'
+    The page count comes from the paginator's last link; the item counter is
+    the fallback. With show_all the whole catalog is requested at once, and
+    the usual pagination follows only if the site ignored that.
+    """
+    url = catalog_page_url(url, 1, show_all)
+    adapter = sites.get_site(url)
+    if adapter is None:
+        return None # Для неизвестного сайта товаров нет
+    try:
+        html = _fetch_html(url)
+    except requests.exceptions.RequestException as e:
+        print(f"Ошибка сети или HTTP при загрузке первой страницы: {e}")
+        metrics.count('errors_total', site=adapter.name, stage='catalog_fetch')
+        return None
+    return _parse_html(parse_first_catalog_html, url, html, extract_products, show_all,
+                       in_pool=extract_products is extract_catalog_products)
+
+def parse_first_catalog_html(url, html, extract_products=extract_catalog_products, show_all=False):
+    """parse_first_catalog_page for a page that is already downloaded from
+    url (built with catalog_page_url(..., 1, show_all)).
+    """
+    items_per_page = 20 # Значение по умолчанию, может быть уточнено после первой страницы
 
-    if site == 'unknown':
-        return [], 0 # Возвращаем пустой список и 0 товаров для неизвестного сайта
+    adapter = sites.get_site(url)
+    if adapter is None:
+        return None # Для неизвестного сайта товаров нет
+    site = adapter.name
+    site_root_url = adapter.root_url # Корневой URL сайта
 
     total_items_overall = 0
     total_pages = 1
 
-    # Шаг 1: Парсим первую страницу для определения общего числа товаров и товаров на страницу
+    # Парсим первую страницу для определения общего числа товаров и товаров на страницу
     try:
-        soup = _fetch_page(url) # Используем исходный URL для первой страницы
-
-        if site == 'rollingmoto':
-            total_items_tag = soup.find('span', class_='element-count muted font_xs rounded3')
-            if total_items_tag:
-                text = total_items_tag.text.strip()
-                match = re.search(r'\d+', text)
-                if match:
-                    total_items_overall = int(match.group(0))
-                    products_on_first_page = soup.find_all('div', class_='catalog_item_wrapp')
-                    if products_on_first_page:
-                        items_per_page = len(products_on_first_page)
-                    total_pages = (total_items_overall + items_per_page - 1) // items_per_page
-                else:
-                    print("Не удалось определить общее число товаров на первой странице Rollingmoto.")
-            else:
-                print("Элемент с общим числом товаров не найден на первой странице Rollingmoto.")
-            products_data.extend(_parse_rollingmoto_catalog(soup, site_root_url)) # Передаем site_root_url
-
-        elif site == 'motoland':
-            total_items_tag = soup.find('span', class_='element-count font_18 bordered button-rounded-x')
-            if total_items_tag:
-                text = total_items_tag.text.strip()
-                match = re.search(r'\d+', text)
-                if match:
-                    total_items_overall = int(match.group(0))
-                    products_on_first_page = soup.find_all('div', class_='grid-list__item')
-                    if products_on_first_page:
-                        items_per_page = len(products_on_first_page)
-                    total_pages = (total_items_overall + items_per_page - 1) // items_per_page
-                else:
-                    print("Не удалось определить общее число товаров на первой странице Motoland.")
-            else:
-                print("Элемент с общим числом товаров не найден на первой странице Motoland.")
-            products_data.extend(_parse_motoland_catalog(soup, site_root_url)) # Передаем site_root_url
+        soup = _make_soup(html, parse_only=adapter.catalog_parse_only)
+
+        total_items_tag = adapter.catalog_count.select_one(soup)
+        products_on_first_page = adapter.find_cards(soup)
+        last_page = adapter.last_page(soup)
+        if total_items_tag:
+            text = total_items_tag.text.strip()
+            match = re.search(r'\d+', text)
+            if match:
+                total_items_overall = int(match.group(0))
+                if products_on_first_page:
+                    items_per_page = len(products_on_first_page)
+                total_pages = (total_items_overall + items_per_page - 1) // items_per_page
+            elif last_page is None:
+                print(f"Не удалось определить общее число товаров на первой странице {adapter.title}.")
+        elif last_page is None:
+            print(f"Элемент с общим числом товаров не найден на первой странице {adapter.title}.")
+        if show_all and total_items_overall and len(products_on_first_page or []) >= total_items_overall:
+            total_pages = 1 # Сайт отдал весь каталог сразу
+        elif last_page is not None:
+            # Пагинатор строится по той же выборке, что и страница, а счетчик бывает устаревшим
+            total_pages = last_page
+        products_data = extract_products(site, url, soup, site_root_url) # Передаем site_root_url
 
-    except requests.exceptions.RequestException as e:
-        print(f"Ошибка сети или HTTP при загрузке первой страницы: {e}")
-        return [], 0
     except Exception as e:
         print(f"Произошла ошибка во время парсинга первой страницы: {e}")
-        return [], 0
+        metrics.count('errors_total', site=site, stage='catalog_parse')
+        return None
 
-    # Шаг 2: Парсим все остальные страницы
-    for page_num in range(2, total_pages + 1):
-        try:
-            current_url = f"{pagination_base_url}?PAGEN_1={page_num}" # Используем pagination_base_url
-            current_url = _normalize_url_slashes(current_url) # Нормализуем URL для пагинации
-            soup = _fetch_page(current_url)
-
-            if site == 'rollingmoto':
-                # print(f"Rollingmoto пагинация: base_url={base_url}, current_url={current_url}") # Удаляем строку для отладки
-                products_on_page = soup.find_all('div', class_='catalog_item_wrapp')
-                if not products_on_page:
-                    print(f"На странице {page_num} товары не найдены. Предполагается конец каталога.")
-                    break
-                products_data.extend(_parse_rollingmoto_catalog(soup, site_root_url)) # Передаем site_root_url
+    return site, total_items_overall, total_pages, products_data
 
-            elif site == 'motoland':
-                catalog_block = soup.find('div', class_='catalog-block')
-                if not catalog_block:
-                    print(f"Блок каталога на странице Motoland {page_num} не найден. Предполагается конец.")
-                    break
-                products_on_page = catalog_block.find_all('div', class_='grid-list__item')
-                if not products_on_page:
-                    print(f"На странице Motoland {page_num} товары не найдены. Предполагается конец каталога.")
+def parse_catalog_page(url, page_num, extract_products=extract_catalog_products):
+    """Loads one pagination page (page_num >= 2) of the catalog at url.
+    Returns None when the catalog has ended and an empty list when the page
+    failed and should be skipped.
+    """
+    adapter = sites.get_site(url)
+    if adapter is None: return None
+    return _parse_catalog_page(adapter.name, page_num, catalog_page_url(url, page_num), adapter.root_url, extract_products)
+
+def parse_catalog_page_html(page_url, page_num, html, extract_products=extract_catalog_products):
+    """parse_catalog_page for a page that is already downloaded from page_url."""
+    adapter = sites.get_site(page_url)
+    if adapter is None: return None
+    return _parse_catalog_html(adapter.name, page_num, page_url, html, adapter.root_url, extract_products)
+
+def iter_catalog(url, max_workers=DEFAULT_PAGE_WORKERS, extract_products=extract_catalog_products, show_all=False):
+    """Yields the catalog page by page as soon as each page is parsed:
+    {"page": i, "totalPages": n, "totalItems": total, "products": [...]}.
+    Nothing is yielded for an unknown site or a failed first page.
+    Pagination stops at the first page that repeats the previous one.
+    """
+    # Шаг 1: первая страница дает общее число товаров и страниц
+    first_page = parse_first_catalog_page(url, extract_products, show_all)
+    if first_page is None:
+        return
+    site, total_items_overall, total_pages, products_data = first_page
+    site_root_url = sites.SITES_BY_NAME[site].root_url
+
+    yield {"page": 1, "totalPages": total_pages, "totalItems": total_items_overall, "products": products_data}
+
+    # Шаг 2: Парсим все остальные страницы параллельно, сохраняя порядок товаров
+    page_urls = [(page_num, catalog_page_url(url, page_num)) for page_num in range(2, total_pages + 1)]
+    if page_urls:
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(page_urls))))
+        try:
+            # executor.map отдает результаты в порядке страниц, даже если они загрузились не по порядку
+            parse_page = metrics.bind(lambda page: _parse_catalog_page(site, page[0], page[1], site_root_url, extract_products))
+            pages = executor.map(parse_page, page_urls)
+            previous_products = products_data
+            for (page_num, _), page_products in zip(page_urls, pages):
+                if page_products is None:
+                    break # Конец каталога: последующие страницы отбрасываем
+                if same_products(page_products, previous_products):
+                    print(f"Страница {page_num} повторяет предыдущую. Предполагается конец каталога.")
                     break
-                products_data.extend(_parse_motoland_catalog(soup, site_root_url)) # Передаем site_root_url
-
-        except requests.exceptions.RequestException as e:
-            print(f"Ошибка сети или HTTP при загрузке страницы {page_num}: {e}. Пропускаем.")
-            continue
-        except Exception as e:
-            print(f"Ошибка парсинга страницы {page_num}: {e}. Пропускаем.")
-            continue
+                if page_products: previous_products = page_products
+                yield {"page": page_num, "totalPages": total_pages, "totalItems": total_items_overall, "products": page_products}
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
 
+def parse_catalog(url, max_workers=DEFAULT_PAGE_WORKERS, extract_products=extract_catalog_products, show_all=False):
+    products_data = []
+    total_items_overall = 0
+    for batch in iter_catalog(url, max_workers=max_workers, extract_products=extract_products, show_all=show_all):
+        products_data.extend(batch["products"])
+        total_items_overall = batch["totalItems"]
     return products_data, total_items_overall
 
 def parse_product(url):
-    site = 'unknown'
-    site_root_url = '' # Изменяем base_url на site_root_url
-    if 'rollingmoto.ru' in url:
-        site = 'rollingmoto'
-        site_root_url = 'https://www.rollingmoto.ru/'
-    elif 'motoland-shop.ru' in url:
-        site = 'motoland'
-        site_root_url = 'https://motoland-shop.ru/'
-    else:
+    adapter = sites.get_site(url)
+    if adapter is None:
         print(f"Неподдерживаемый сайт для парсинга товара: {url}")
         return {}
 
     try:
-        soup = _fetch_page(url)
-        product_data = {}
-
-        if site == 'rollingmoto':
-            try:
-                # Получение наименования товара
-                product_title_tag = soup.find('h1', {'id': 'pagetitle'})
-                product_name = product_title_tag.text.strip() if product_title_tag else "Наименование не найдено"
-                product_brand, product_model, product_year = parse_vehicle_description(product_name)
-
-                product_data["brand"] = product_brand
-                product_data["model"] = product_model
-                product_data["year"] = product_year
-                product_data["name"] = product_name
-                product_data["link"] = url
-
-                # Получение всех изображений
-                images = []
-                gallery_items = soup.find_all('div', class_='product-detail-gallery__item')
-                for item in gallery_items:
-                    img_link = item.find('a', class_='product-detail-gallery__link')
-                    if img_link and img_link.has_attr('href'):
-                        image_url = img_link['href']
-                        if not image_url.startswith('http'):
-                            image_url = f"{site_root_url}{image_url}"
-                        images.append(_normalize_url_slashes(image_url))
-                product_data["images"] = images
-
-                # Получение новой и старой цены
-                new_price_tag = soup.find('div', class_='price', attrs={'data-value': True})
-                product_data["price"] = new_price_tag['data-value'] if new_price_tag else "N/A"
-
-                old_price_tag = soup.find('div', class_='price discount', attrs={'data-value': True})
-                product_data["old_price"] = old_price_tag['data-value'] if old_price_tag else None
-
-                product_data["discount"] = None
-                product_data["economy"] = None
-
-                # Получение описания товара
-                description_tag = soup.find('div', class_='content detail-text-wrap')
-                product_data["description"] = description_tag.get_text(strip=True) if description_tag else ""
-
-                # Получение характеристик товара
-                characteristics = {}
-                characteristics_table = soup.find('table', class_='props_list nbg')
-                if characteristics_table:
-                    for row in characteristics_table.find_all('tr', class_='js-prop-replace'):
-                        name_tag = row.find('span', class_='js-prop-title')
-                        value_tag = row.find('span', class_='js-prop-value')
-                        if name_tag and value_tag:
-                            name = name_tag.get_text(strip=True)
-                            value = value_tag.get_text(strip=True)
-                            characteristics[name] = value
-                product_data["characteristics"] = characteristics
-
-                product_data["site"] = "rollingmoto"
-                return product_data
-            except Exception as e:
-                print(f"Ошибка парсинга товара Rollingmoto на странице {url}: {e}")
-                return {}
-
-        elif site == 'motoland':
-            try:
-                # Получение наименования товара
-                product_name = soup.find('h1', class_='font_24 switcher-title js-popup-title mb mb--0')
-                product_data["name"] = product_name.get_text(strip=True) if product_name else "Наименование не найдено"
-                product_brand, product_model, product_year = parse_vehicle_description(product_data["name"])
-
-                product_data["brand"] = product_brand
-                product_data["model"] = product_model
-                product_data["year"] = product_year
-                product_data["link"] = url
-
-                # Получение изображений
-                images = []
-                gallery_div = soup.find('div', class_='detail-gallery-big swipeignore image-list__link')
-                if gallery_div:
-                    img_tags = gallery_div.find_all('img')
-                    for img in img_tags:
-                        src = img.get('data-src')
-                        if src:
-                            images.append(_normalize_url_slashes(site_root_url.rstrip('/') + src))
-                product_data["images"] = images
-
-                # Получение цен
-                price_row_div = soup.find('div', class_='price__row')
-                if price_row_div:
-                    new_price_tag = price_row_div.find('span', class_='price__new-val font_24')
-                    product_data["price"] = new_price_tag.get_text(strip=True) if new_price_tag else "N/A"
-
-                    old_price_tag = price_row_div.find('del', class_='price__old-val font_15 secondary-color')
-                    product_data["old_price"] = old_price_tag.get_text(strip=True) if old_price_tag else None
-                else:
-                    product_data["price"] = "N/A"
-                    product_data["old_price"] = None
-
-                product_data["discount"] = None
-                product_data["economy"] = None
-
-                # Получение описания
-                description_div = soup.find('div', class_='content content--max-width js-detail-description')
-                product_data["description"] = description_div.get_text(strip=True) if description_div else ""
-
-                # Получение характеристик товара
-                characteristics = {}
-                characteristics_div = soup.find('div', class_='properties-group__items js-offers-group__items-wrap font_15')
-                if characteristics_div:
-                    items = characteristics_div.find_all('div', class_='properties-group__item')
-                    for item in items:
-                        name_tag = item.find('span', class_='properties-group__name')
-                        value_tag = item.find('div', class_='properties-group__value color_dark')
-                        if name_tag and value_tag:
-                            name = name_tag.get_text(strip=True)
-                            value = value_tag.get_text(strip=True)
-                            characteristics[name] = value
-                product_data["characteristics"] = characteristics
-
-                product_data["site"] = "motoland"
-                return product_data
-            except Exception as e:
-                print(f"Ошибка парсинга товара Motoland на странице {url}: {e}")
-                return {}
-
+        html = _fetch_html(url)
     except requests.exceptions.RequestException as e:
         print(f"Ошибка сети или HTTP при загрузке страницы товара {url}: {e}")
+        metrics.count('errors_total', site=adapter.name, stage='product_fetch')
         return {}
+    return _parse_html(parse_product_html, url, html)
+
+def parse_product_html(url, html):
+    """parse_product for a product page that is already downloaded from url."""
+    adapter = sites.get_site(url)
+    if adapter is None: return {}
+    try:
+        soup = _make_soup(html)
     except Exception as e:
         print(f"Произошла непредвиденная ошибка во время обработки страницы товара {url}: {e}")
-        return {} 
\ No newline at end of file
+        metrics.count('errors_total', site=adapter.name, stage='product_parse')
+        return {}
+    try:
+        with metrics.stage('extract'):
+            fields = {}
+            sites.extract_fields(adapter.product_fields, soup, adapter.root_url, fields)
+            fields["link"] = url
+            return _build_product(adapter, fields, extra={"characteristics": fields.get("characteristics", {})})
+    except Exception as e:
+        print(f"Ошибка парсинга товара {adapter.title} на странице {url}: {e}")
+        metrics.count('errors_total', site=adapter.name, stage='product_parse')
+        return {}
+
+def parse_products(urls, max_workers=DEFAULT_PRODUCT_WORKERS):
+    """Runs parse_product for many product URLs concurrently.
+    Returns {url: {"details": {...}}} or {url: {"error": "..."}} per URL, in input order.
+    """
+    urls = list(dict.fromkeys(urls)) # Повторяющиеся URL парсим один раз
+    results = {}
+    if not urls: return results
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as executor:
+        for url, product_details in zip(urls, executor.map(metrics.bind(parse_product), urls)):
+            if product_details:
+                results[url] = {"details": product_details}
+            elif sites.get_site(url) is None:
+                results[url] = {"error": "Неподдерживаемый сайт"}
+            else:
+                results[url] = {"error": "Ошибка парсинга страницы товара"}
+    return results
@@ -0,0 +1,176 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+import sites
+from records import parse_price
+from urls import normalize_link
+
+# История цен: каждый разбор каталога или товара записывает цены товаров, а в
+# таблицу изменений попадает строка, только когда цена или старая цена сменились.
+# Запросы "что подешевело с T" и "история товара" идут по индексам и не требуют обхода.
+PRICE_HISTORY_ENABLED = True
+PRICE_DB_PATH = os.path.join(tempfile.gettempdir(), 'mono-uniparser-prices.sqlite3')
+DEFAULT_CHANGES_LIMIT = 1000
+
+_SELECT_CHUNK = 500 # Ссылок в одном IN (...): SQLite ограничивает число параметров запроса
+
+class SQLitePriceStore:
+    """Current prices per product link plus the log of their changes, in a
+    SQLite file shared by all worker processes.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or PRICE_DB_PATH
+        with closing(self._connect()) as conn, conn:
+            # WAL: запросы истории читают базу, пока другой процесс дописывает свежий обход
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS products ("
+                "link TEXT PRIMARY KEY, site TEXT, name TEXT, price INTEGER, old_price INTEGER, "
+                "first_seen REAL NOT NULL, last_seen REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS price_changes ("
+                "id INTEGER PRIMARY KEY, link TEXT NOT NULL, price INTEGER, old_price INTEGER, "
+                "previous_price INTEGER, previous_old_price INTEGER, is_new INTEGER NOT NULL, changed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS price_changes_changed_at ON price_changes (changed_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS price_changes_link ON price_changes (link, changed_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def record(self, products, observed_at):
+        """Stores the prices of parsed products; returns how many changed
+        (products seen for the first time included).
+        """
+        latest = {}
+        for product in products:
+            if not product.get('link'): continue
+            # Один товар бывает в нескольких разделах: учитываем последнее появление
+            latest[normalize_link(product['link'])] = product
+        if not latest: return 0
+        links = list(latest)
+        changes = []
+        with closing(self._connect()) as conn, conn:
+            known = {}
+            for i in range(0, len(links), _SELECT_CHUNK):
+                chunk = links[i:i + _SELECT_CHUNK]
+                rows = conn.execute(
+                    f"SELECT link, price, old_price FROM products WHERE link IN ({', '.join('?' * len(chunk))})", chunk
+                )
+                known.update((link, (price, old_price)) for link, price, old_price in rows)
+            upserts = []
+            for link, product in latest.items():
+                price, old_price = parse_price(product.get('price')), parse_price(product.get('old_price'))
+                if link in known and not _has_old_price(product):
+                    old_price = known[link][1] # Источник без старой цены оставляет известную
+                upserts.append((link, product.get('site'), product.get('name'), price, old_price, observed_at, observed_at))
+                if link not in known:
+                    changes.append((link, price, old_price, None, None, 1, observed_at))
+                elif known[link] != (price, old_price):
+                    changes.append((link, price, old_price, *known[link], 0, observed_at))
+            conn.executemany(
+                "INSERT INTO products (link, site, name, price, old_price, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (link) DO UPDATE SET site = excluded.site, name = excluded.name, price = excluded.price, "
+                "old_price = excluded.old_price, last_seen = excluded.last_seen", upserts,
+            )
+            conn.executemany(
+                "INSERT INTO price_changes (link, price, old_price, previous_price, previous_old_price, is_new, changed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", changes,
+            )
+        return len(changes)
+
+    def changes_since(self, since, site=None, include_new=False, limit=DEFAULT_CHANGES_LIMIT):
+        query = (
+            "SELECT c.link, p.site, p.name, c.price, c.old_price, c.previous_price, c.previous_old_price, c.is_new, c.changed_at "
+            "FROM price_changes c JOIN products p ON p.link = c.link WHERE c.changed_at > ?"
+        )
+        params = [since]
+        if not include_new: query += " AND c.is_new = 0"
+        if site:
+            query += " AND p.site = ?"
+            params.append(site)
+        query += " ORDER BY c.changed_at, c.id LIMIT ?"
+        params.append(limit)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [{"link": link, "site": site, "name": name, "price": price, "old_price": old_price,
+                 "previousPrice": previous_price, "previousOldPrice": previous_old_price,
+                 "isNew": bool(is_new), "changedAt": changed_at}
+                for link, site, name, price, old_price, previous_price, previous_old_price, is_new, changed_at in rows]
+
+    def history(self, link):
+        link = normalize_link(link)
+        with closing(self._connect()) as conn:
+            product = conn.execute(
+                "SELECT site, name, price, old_price, first_seen, last_seen FROM products WHERE link = ?", (link,)
+            ).fetchone()
+            if product is None: return None
+            rows = conn.execute(
+                "SELECT price, old_price, changed_at FROM price_changes WHERE link = ? ORDER BY changed_at, id", (link,)
+            ).fetchall()
+        site, name, price, old_price, first_seen, last_seen = product
+        return {"link": link, "site": site, "name": name, "price": price, "old_price": old_price,
+                "firstSeen": first_seen, "lastSeen": last_seen,
+                "history": [{"price": p, "old_price": o, "changedAt": t} for p, o, t in rows]}
+
+def _has_old_price(product):
+    # Карточки каталога Motoland старую цену не показывают: None там значит "неизвестно",
+    # а не "скидка закончилась". Страницу товара отличаем по полю characteristics
+    adapter = sites.SITES_BY_NAME.get(product.get('site'))
+    return adapter is None or adapter.declares('old_price', product_page='characteristics' in product)
+
+_store = None
+_setup_lock = threading.Lock()
+
+def configure(enabled=None, store=None, path=None):
+    """Turns recording on/off or replaces the store (any object with
+    record, changes_since and history, or a SQLite file at `path`).
+    """
+    global PRICE_HISTORY_ENABLED, PRICE_DB_PATH, _store
+    with _setup_lock:
+        if enabled is not None: PRICE_HISTORY_ENABLED = enabled
+        if path is not None:
+            PRICE_DB_PATH = path
+            _store = None
+        if store is not None: _store = store
+
+def _get_store():
+    global _store
+    with _setup_lock:
+        if _store is None: _store = SQLitePriceStore()
+        return _store
+
+def record(products, observed_at=None):
+    """Records prices after a parse. Never raises: a broken history must not
+    fail the parse that produced the products.
+    """
+    if not PRICE_HISTORY_ENABLED or not products: return 0
+    try:
+        return _get_store().record(products, observed_at or time.time())
+    except sqlite3.Error as e:
+        print(f"Ошибка записи истории цен: {e}")
+        return 0
+
+def changes_since(since, site=None, include_new=False, limit=DEFAULT_CHANGES_LIMIT):
+    """Price changes after the unix time `since`, oldest first. Products seen
+    for the first time are left out unless include_new is set.
+    """
+    return _get_store().changes_since(since, site=site, include_new=include_new, limit=limit)
+
+def history(link):
+    """All recorded prices of one product, or None if it was never parsed."""
+    return _get_store().history(link)
+
+def parse_since(value):
+    """Accepts unix seconds or an ISO 8601 date/time; raises ValueError."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
@@ -0,0 +1,150 @@
+import csv
+import io
+import json
+import re
+
+# Компактное представление товара для выгрузок: цены целыми числами в рублях,
+# год числом, изображения кортежем. Экспорт в CSV всегда доступен, Parquet и
+# Arrow — если установлен pyarrow.
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+ARROW_AVAILABLE = pa is not None
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.file', 'arrow'),
+}
+
+_NUMBER_RE = re.compile(r'\d[\d\s]*') # \s включает и неразрывные пробелы между разрядами
+
+def parse_price(value):
+    """Returns the integer amount from a price string such as "129 990 ₽",
+    "-10%" or "100049"; None when there is no number ("N/A", None).
+    Kopecks after a comma or dot are dropped.
+    """
+    if value is None: return None
+    if isinstance(value, int): return value
+    match = _NUMBER_RE.search(str(value))
+    if not match: return None
+    return int(re.sub(r'\D', '', match.group(0)))
+
+class ProductRecord:
+    __slots__ = ('brand', 'model', 'year', 'name', 'link', 'images', 'description',
+                 'price', 'old_price', 'discount', 'economy', 'site', 'characteristics')
+
+    def __init__(self, brand, model, year, name, link, images, description,
+                 price, old_price, discount, economy, site, characteristics=None):
+        self.brand = brand
+        self.model = model
+        self.year = year
+        self.name = name
+        self.link = link
+        self.images = images
+        self.description = description
+        self.price = price
+        self.old_price = old_price
+        self.discount = discount # Скидка в процентах
+        self.economy = economy # Экономия в рублях
+        self.site = site
+        self.characteristics = characteristics
+
+    @classmethod
+    def from_dict(cls, product):
+        """Builds a record from a product dict returned by the parser."""
+        year = product.get('year')
+        return cls(
+            brand=product.get('brand') or '',
+            model=product.get('model') or '',
+            year=int(year) if year else None,
+            name=product.get('name') or '',
+            link=product.get('link') or '',
+            images=tuple(product.get('images') or ()),
+            description=product.get('description') or '',
+            price=parse_price(product.get('price')),
+            old_price=parse_price(product.get('old_price')),
+            discount=parse_price(product.get('discount')),
+            economy=parse_price(product.get('economy')),
+            site=product.get('site') or '',
+            characteristics=product.get('characteristics'),
+        )
+
+    def as_dict(self):
+        product = {name: getattr(self, name) for name in self.__slots__}
+        product['images'] = list(self.images)
+        if product['characteristics'] is None: del product['characteristics']
+        return product
+
+    def __repr__(self):
+        return f"ProductRecord({self.site}: {self.name!r}, {self.price})"
+
+def from_products(products):
+    return [ProductRecord.from_dict(product) for product in products]
+
+def _columns(records):
+    names = [name for name in ProductRecord.__slots__ if name != 'characteristics']
+    if any(record.characteristics for record in records): names.append('characteristics')
+    return names
+
+def to_csv(records):
+    """CSV with a BOM, so Excel opens the Cyrillic text correctly. Images are
+    separated by spaces, characteristics are a JSON object.
+    """
+    names = _columns(records)
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(names)
+    for record in records:
+        row = []
+        for name in names:
+            value = getattr(record, name)
+            if name == 'images': value = ' '.join(value)
+            elif name == 'characteristics': value = json.dumps(value or {}, ensure_ascii=False)
+            row.append('' if value is None else value)
+        writer.writerow(row)
+    return ('\ufeff' + output.getvalue()).encode('utf-8')
+
+def _arrow_table(records):
+    if pa is None:
+        raise RuntimeError("Для выгрузки в Parquet/Arrow нужен пакет pyarrow")
+    names = _columns(records)
+    types = {
+        'year': pa.int16(), 'price': pa.int64(), 'old_price': pa.int64(), 'discount': pa.int16(),
+        'economy': pa.int64(), 'images': pa.list_(pa.string()), 'characteristics': pa.map_(pa.string(), pa.string()),
+    }
+    schema = pa.schema([(name, types.get(name, pa.string())) for name in names])
+    columns = {}
+    for name in names:
+        values = [getattr(record, name) for record in records]
+        if name == 'images': values = [list(images) for images in values]
+        elif name == 'characteristics': values = [list((value or {}).items()) for value in values]
+        columns[name] = values
+    return pa.table(columns, schema=schema)
+
+def to_parquet(records):
+    table = _arrow_table(records)
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink)
+    return sink.getvalue().to_pybytes()
+
+def to_arrow(records):
+    """Arrow IPC file (Feather v2)."""
+    table = _arrow_table(records)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def export(records, export_format):
+    """Returns (body, content_type, file extension); raises ValueError on an
+    unknown format and RuntimeError when pyarrow is missing.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Неподдерживаемый формат выгрузки: {export_format}")
+    content_type, extension = EXPORT_FORMATS[export_format]
+    writers = {'csv': to_csv, 'parquet': to_parquet, 'arrow': to_arrow}
+    return writers[export_format](records), content_type, extension
@@ -0,0 +1,316 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import metrics
+from urls import normalize_url_slashes
+
+try:
+    import fcntl
+except ImportError: # Windows: блокировка между процессами недоступна, остается объединение внутри процесса
+    fcntl = None
+
+# Кэш результатов /parse_url: популярный каталог, который одновременно вставили
+# несколько пользователей, парсится один раз. Одинаковые запросы, пришедшие во
+# время парсинга, ждут его результат (single-flight), а не запускают свой обход.
+# По умолчанию результаты хранятся в памяти процесса; для нескольких воркеров
+# gunicorn/uvicorn — в общей папке на диске, где обход одного ключа защищен
+# файловой блокировкой.
+RESULT_CACHE_ENABLED = True
+RESULT_TTL = 120 # Секунд, в течение которых результат отдается без обхода
+RESULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'mono-uniparser-results')
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024 # Папка хранилища 'file': при превышении удаляются самые старые результаты
+SWEEP_INTERVAL = 600 # Не чаще раза в столько секунд хранилище 'file' удаляет истекшие результаты
+
+class MemoryResultStore:
+    """Results of this process only."""
+
+    def __init__(self):
+        self._entries = {} # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None: return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            # Заодно выбрасываем истекшие записи, чтобы словарь не рос бесконечно
+            for stale in [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]:
+                del self._entries[stale]
+            self._entries[key] = (now + ttl, value)
+
+    def lock(self, key):
+        return _NoLock()
+
+class _NoLock:
+    def acquire(self): pass
+    def release(self): pass
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self):
+        if fcntl is None: return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def release(self):
+        if self._fd is None: return
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _lock_is_free(path):
+    if fcntl is None: return False
+    try:
+        fd = os.open(path, os.O_RDWR)
+    except OSError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+    finally:
+        os.close(fd) # Закрытие снимает и взятую блокировку
+
+class FileResultStore:
+    """Results shared by all worker processes on the host, one JSON file per
+    key. lock(key) serializes the crawl of a key across the processes.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or RESULT_CACHE_DIR
+        self._lock = threading.Lock()
+        self._size = None # Байт в папке по подсчету этого процесса; None — еще не считали
+        self._last_sweep = None
+
+    def _path(self, key, suffix):
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name[:2], name + suffix)
+
+    def get(self, key):
+        path = self._path(key, '.json')
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry['expires_at'] <= time.time():
+            _remove(path)
+            return None
+        return entry['value']
+
+    def set(self, key, value, ttl):
+        path = self._path(key, '.json')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'key': key, 'expires_at': time.time() + ttl, 'value': value}, f, ensure_ascii=False)
+            size = f.tell()
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._size is not None: self._size += size
+            if (self._last_sweep is not None and time.monotonic() - self._last_sweep < SWEEP_INTERVAL
+                    and self._size <= RESULT_CACHE_MAX_BYTES):
+                return
+            self._last_sweep = time.monotonic()
+            self.sweep()
+
+    def sweep(self):
+        """Deletes expired results (and the lock files of keys nobody
+        crawls), then the oldest results until the folder is 10% below
+        RESULT_CACHE_MAX_BYTES.
+        """
+        # Файлы не читаем: результат пишется с RESULT_TTL, поэтому срок виден по времени изменения
+        expired_before = time.time() - RESULT_TTL
+        entries = []
+        for root, dirs, files in os.walk(self.directory):
+            for file in files:
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if file.endswith('.json'):
+                    if stat.st_mtime <= expired_before: _remove(path)
+                    else: entries.append((stat.st_mtime, stat.st_size, path))
+                elif stat.st_mtime <= expired_before:
+                    # Недописанный .tmp упавшего процесса или блокировка ключа, который никто не обходит.
+                    # Если процесс откроет блокировку в момент удаления, худшее — один лишний обход
+                    if file.endswith('.tmp') or (file.endswith('.lock') and _lock_is_free(path)):
+                        _remove(path)
+        self._size = sum(size for _, size, _ in entries)
+        if self._size <= RESULT_CACHE_MAX_BYTES: return
+        target = RESULT_CACHE_MAX_BYTES * 0.9
+        for _, size, path in sorted(entries):
+            if self._size <= target: break
+            _remove(path)
+            self._size -= size
+
+    def lock(self, key):
+        return _FileLock(self._path(key, '.lock'))
+
+_store = MemoryResultStore()
+_flights = {} # key -> _Flight обхода, идущего в этом процессе
+_flights_lock = threading.Lock()
+_async_flights = {} # key -> asyncio.Future для ASGI-приложения
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+def configure(enabled=None, ttl=None, backend=None, cache_dir=None, store=None, max_bytes=None):
+    """backend: 'memory' (default) or 'file' (shared by the processes of one
+    host, in cache_dir, up to max_bytes). Any object with get(key),
+    set(key, value, ttl) and lock(key) can be passed as `store` instead.
+    """
+    global RESULT_CACHE_ENABLED, RESULT_TTL, RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, _store
+    if enabled is not None: RESULT_CACHE_ENABLED = enabled
+    if ttl is not None: RESULT_TTL = ttl
+    if max_bytes is not None: RESULT_CACHE_MAX_BYTES = max_bytes
+    if cache_dir is not None: RESULT_CACHE_DIR = cache_dir
+    if store is not None:
+        _store = store
+    elif backend == 'memory':
+        _store = MemoryResultStore()
+    elif backend == 'file' or (cache_dir is not None and isinstance(_store, FileResultStore)):
+        _store = FileResultStore(RESULT_CACHE_DIR)
+    elif backend is not None:
+        raise ValueError(f"Неизвестное хранилище кэша результатов: {backend}")
+
+def make_key(kind, url, **options):
+    """Cache key: page kind, normalized URL and the options that change the result."""
+    key = f"{kind}:{normalize_url_slashes(url.strip())}"
+    for name in sorted(options):
+        if options[name]: key += f"|{name}={options[name]}"
+    return key
+
+def _compute_and_store(key, compute):
+    lock = _store.lock(key)
+    lock.acquire()
+    try:
+        # Пока ждали блокировку, результат мог положить другой процесс
+        value = _store.get(key)
+        if value is not None:
+            metrics.count('result_cache_requests_total', result='hit')
+            return value
+        metrics.count('result_cache_requests_total', result='miss')
+        value = compute()
+        if value: # Ошибки и пустые каталоги не кэшируем
+            try:
+                _store.set(key, value, RESULT_TTL)
+            except OSError as e:
+                print(f"Ошибка записи в кэш результатов {key}: {e}")
+        return value
+    finally:
+        lock.release()
+
+def get_or_compute(key, compute):
+    """Returns the cached result for key, or calls compute() once for all
+    threads asking for the same key at the same time. Falsy results are
+    returned but not cached.
+    """
+    if not RESULT_CACHE_ENABLED: return compute()
+    value = _store.get(key)
+    if value is not None:
+        metrics.count('result_cache_requests_total', result='hit')
+        return value
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader: flight = _flights[key] = _Flight()
+    if not leader:
+        flight.done.wait()
+        metrics.count('result_cache_requests_total', result='coalesced')
+        if flight.error is not None: raise flight.error
+        return flight.value
+    try:
+        flight.value = _compute_and_store(key, compute)
+        return flight.value
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+async def _acquire(lock):
+    acquiring = asyncio.ensure_future(asyncio.to_thread(lock.acquire))
+    try:
+        await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        # Поток все равно возьмет блокировку: отпускаем ее, как только он закончит
+        acquiring.add_done_callback(lambda _: lock.release())
+        raise
+
+async def get_or_compute_async(key, compute):
+    """get_or_compute() for the ASGI app: compute is a coroutine function,
+    and requests waiting for the same key do not block the event loop.
+    """
+    if not RESULT_CACHE_ENABLED: return await compute()
+    value = await asyncio.to_thread(_store.get, key)
+    if value is not None:
+        metrics.count('result_cache_requests_total', result='hit')
+        return value
+    future = _async_flights.get(key)
+    if future is not None:
+        try:
+            value = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.cancelled(): raise
+            # Клиент первого запроса отключился и обход прервался: начинаем его заново
+            return await get_or_compute_async(key, compute)
+        metrics.count('result_cache_requests_total', result='coalesced')
+        return value
+    future = _async_flights[key] = asyncio.get_running_loop().create_future()
+    try:
+        lock = _store.lock(key)
+        await _acquire(lock)
+        try:
+            value = await asyncio.to_thread(_store.get, key)
+            if value is not None:
+                metrics.count('result_cache_requests_total', result='hit')
+            else:
+                metrics.count('result_cache_requests_total', result='miss')
+                value = await compute()
+                if value:
+                    try:
+                        await asyncio.to_thread(_store.set, key, value, RESULT_TTL)
+                    except OSError as e:
+                        print(f"Ошибка записи в кэш результатов {key}: {e}")
+        finally:
+            lock.release()
+        future.set_result(value)
+        return value
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception() # Ожидающих может не быть: помечаем исключение полученным
+        raise
+    finally:
+        del _async_flights[key]
@@ -0,0 +1,320 @@
+import re
+from urllib.parse import urlsplit
+import soupsieve as sv
+from bs4 import SoupStrainer
+from urls import normalize_url_slashes
+
+# Реестр поддерживаемых магазинов. Каждый сайт один раз объявляет свои селекторы;
+# они компилируются при импорте модуля, а parser_logic применяет их к каждой карточке.
+# Чтобы добавить магазин, достаточно описать еще один SiteAdapter и вызвать register().
+
+def _join_url(site_root_url, url):
+    if not url.startswith('http'):
+        url = site_root_url + url.lstrip('/')
+    return normalize_url_slashes(url)
+
+class Field:
+    """One value taken from the first element matching the selector (or, with
+    many=True, from every matching element).
+
+    text='text' takes .text.strip(), text='strip' takes get_text(strip=True);
+    attr takes an attribute instead. A list of selectors is tried in order;
+    selector None means the node itself (e.g. the group element).
+    """
+
+    def __init__(self, name, selectors, attr=None, text='text', many=False, url=False,
+                 exclude=None, default=None, required=False):
+        if selectors is None or isinstance(selectors, str): selectors = [selectors]
+        self.name = name
+        self.selectors = [sv.compile(selector) if selector is not None else None for selector in selectors]
+        self.attr = attr
+        self.text = text
+        self.many = many
+        self.url = url
+        self.exclude = exclude
+        self.default = default
+        self.required = required
+
+    def _value(self, element):
+        if self.attr is not None:
+            return element.get(self.attr)
+        if self.text == 'strip':
+            return element.get_text(strip=True)
+        return element.text.strip()
+
+    def extract(self, node, site_root_url, result):
+        """Stores the value into result; returns False when a required value is missing."""
+        if self.many:
+            values = []
+            for selector in self.selectors:
+                for element in selector.select(node):
+                    value = self._value(element)
+                    if not value or (self.exclude and self.exclude in value): continue
+                    values.append(_join_url(site_root_url, value) if self.url else value)
+            result[self.name] = values
+            return True
+
+        for selector in self.selectors:
+            element = selector.select_one(node) if selector is not None else node
+            if element is None: continue
+            value = self._value(element)
+            if value is not None and self.url:
+                value = _join_url(site_root_url, value)
+            result[self.name] = value if value is not None else self.default
+            return not (self.required and value is None)
+        result[self.name] = self.default
+        return not self.required
+
+class Group:
+    """Fields looked up inside one element that is found once per card.
+
+    fields are relative to the group element; gated fields are relative to
+    the enclosing node but are only extracted when the group element exists.
+    """
+
+    def __init__(self, selector, fields=(), gated=(), required=False):
+        self.selector = sv.compile(selector)
+        self.fields = fields
+        self.gated = gated
+        self.required = required
+
+    def extract(self, node, site_root_url, result):
+        element = self.selector.select_one(node)
+        if element is None:
+            for field in (*self.fields, *self.gated):
+                _set_default(field, result)
+            return not self.required
+        return (extract_fields(self.fields, element, site_root_url, result)
+                and extract_fields(self.gated, node, site_root_url, result))
+
+def _set_default(item, result):
+    if isinstance(item, Group):
+        for field in (*item.fields, *item.gated):
+            _set_default(field, result)
+    else:
+        result[item.name] = [] if item.many else item.default
+
+def field_names(fields):
+    """Names of all values the fields (and groups among them) can produce."""
+    names = set()
+    for item in fields:
+        if isinstance(item, Group):
+            names |= field_names((*item.fields, *item.gated))
+        else:
+            names.add(item.name)
+    return names
+
+def extract_fields(fields, node, site_root_url, result):
+    """Runs every field once against node. Returns False as soon as a required
+    field or group is missing.
+    """
+    for field in fields:
+        if not field.extract(node, site_root_url, result):
+            return False
+    return True
+
+class Pairs:
+    """Name/value table, e.g. product characteristics."""
+
+    def __init__(self, name, rows, key, value):
+        self.name = name
+        self.rows = sv.compile(rows)
+        self.key = sv.compile(key)
+        self.value = sv.compile(value)
+        self.many = False
+        self.default = {}
+
+    def extract(self, node, site_root_url, result):
+        pairs = {}
+        for row in self.rows.select(node):
+            key_tag = self.key.select_one(row)
+            value_tag = self.value.select_one(row)
+            if key_tag and value_tag:
+                pairs[key_tag.get_text(strip=True)] = value_tag.get_text(strip=True)
+        result[self.name] = pairs
+        return True
+
+def _class_strainer(*class_names):
+    """SoupStrainer that keeps only elements having any of the given classes
+    (together with their whole subtree).
+    """
+    wanted = set(class_names)
+    def match(value):
+        if not value: return False
+        # Во время разбора class может прийти как строка "a b c", а не как список
+        classes = value.split() if isinstance(value, str) else value
+        return not wanted.isdisjoint(classes)
+    return SoupStrainer(attrs={'class': match})
+
+_PAGEN_RE = re.compile(r'[?&]PAGEN_1=(\d+)')
+
+def _path_only(url):
+    return url.split('?')[0].split('#')[0] # Удаляем параметры запроса и хеш
+
+class SiteAdapter:
+    def __init__(self, name, title, domain, root_url, catalog_parse_only, catalog_count, catalog_cards,
+                 card_fields, product_fields, product_url_pattern, catalog_container=None, catalog_pagination=None,
+                 catalog_root='catalog/'):
+        self.name = name
+        self.title = title # Название для сообщений об ошибках
+        self.domain = domain
+        self.root_url = root_url
+        self.product_url_re = re.compile(product_url_pattern)
+        self.catalog_root = catalog_root # Путь корня каталога от root_url: под ним ищутся разделы
+        # Поддеревья страницы каталога, которые вообще нужно строить (см. parser_logic._make_soup)
+        self.catalog_parse_only = _class_strainer(*catalog_parse_only)
+        self.catalog_count = sv.compile(catalog_count)
+        self.catalog_container = sv.compile(catalog_container) if catalog_container else None
+        # Ссылки постраничной навигации: по последней из них виден номер последней страницы
+        self.catalog_pagination = sv.compile(catalog_pagination) if catalog_pagination else None
+        self.catalog_cards = sv.compile(catalog_cards)
+        self.card_fields = card_fields
+        self.product_fields = product_fields
+
+    def matches(self, url):
+        if '://' in self.domain:
+            return url.startswith(self.domain) # Локальный стенд benchmarks/run.py: сайты различаются префиксом пути
+        # Сравниваем хост целиком: "motoland-shop.ru" в пути или запросе чужого адреса не делает его адресом магазина
+        host = (urlsplit(url).hostname or '').lower()
+        return host == self.domain or host.endswith('.' + self.domain)
+
+    def declares(self, name, product_page=False):
+        """True when the product page (or, by default, the catalog card) of
+        the site has the field `name` at all.
+        """
+        return name in field_names(self.product_fields if product_page else self.card_fields)
+
+    def is_product_url(self, url):
+        return bool(self.product_url_re.search(_path_only(url)))
+
+    def is_category_url(self, url):
+        """True for a catalog section below catalog_root (not a product, no query)."""
+        catalog_url = self.root_url + self.catalog_root
+        path_only = _path_only(url)
+        return (path_only == url and path_only.startswith(catalog_url)
+                and path_only.rstrip('/') != catalog_url.rstrip('/') and not self.is_product_url(url))
+
+    def category_links(self, soup):
+        """Absolute URLs of the catalog sections linked from the page (menus,
+        section lists), in page order and without repeats. Links inside
+        product cards are skipped: they lead to products.
+        """
+        card_links = {a['href'] for card in self.find_cards(soup) or [] for a in card.find_all('a', href=True)}
+        links = {}
+        for a in soup.find_all('a', href=True):
+            if a['href'] in card_links: continue
+            href = a['href'].strip()
+            if not href or href.startswith(('#', 'javascript:', 'mailto:', 'tel:')): continue
+            url = _join_url(self.root_url, href)
+            if self.is_category_url(url): links.setdefault(url, None)
+        return list(links)
+
+    def last_page(self, soup):
+        """Highest PAGEN_1 number linked from the paginator, or None when the
+        page has no paginator (a single-page catalog or an unknown layout).
+        """
+        if self.catalog_pagination is None: return None
+        last_page = None
+        for a in self.catalog_pagination.select(soup):
+            match = _PAGEN_RE.search(a['href'])
+            if match: last_page = max(last_page or 0, int(match.group(1)))
+        return last_page
+
+    def find_cards(self, soup):
+        """Returns the product cards of a catalog page, or None when the page
+        has no catalog block at all.
+        """
+        if self.catalog_container is not None:
+            container = self.catalog_container.select_one(soup)
+            if container is None: return None
+            return self.catalog_cards.select(container)
+        return self.catalog_cards.select(soup)
+
+ROLLINGMOTO = SiteAdapter(
+    name='rollingmoto',
+    title='Rollingmoto',
+    domain='rollingmoto.ru',
+    root_url='https://www.rollingmoto.ru/',
+    product_url_pattern=r'/product/|/moto/',
+    catalog_parse_only=('catalog_item_wrapp', 'element-count', 'module-pagination'),
+    catalog_count='span.element-count.muted.font_xs.rounded3',
+    catalog_pagination='div.module-pagination a[href]',
+    catalog_cards='div.catalog_item_wrapp',
+    card_fields=(
+        Group('a.dark_link.js-notice-block__title.option-font-bold.font_sm', required=True, fields=(
+            Field('link', None, attr='href', url=True, required=True),
+            Field('name', 'span', default=''),
+        )),
+        Group('div.cost.prices.clearfix', required=True, fields=(
+            Field('images', 'link', attr='href', many=True, url=True, exclude='schema.org'),
+            Field('description', 'meta[itemprop="description"]', attr='content', default=''),
+            Field('price', 'span.price_value', default='N/A'),
+            Group('div.price.discount', fields=(
+                Field('old_price', 'span'),
+            ), gated=(
+                Field('discount', 'div.sale_block span'),
+                Field('economy', 'div.inner-sale span'),
+            )),
+        )),
+    ),
+    product_fields=(
+        Field('name', 'h1#pagetitle', default='Наименование не найдено'),
+        Field('images', 'div.product-detail-gallery__item a.product-detail-gallery__link[href]', attr='href', many=True, url=True),
+        Field('price', 'div.price[data-value]', attr='data-value', default='N/A'),
+        Field('old_price', 'div.price.discount[data-value]', attr='data-value'),
+        Field('description', 'div.content.detail-text-wrap', text='strip', default=''),
+        Pairs('characteristics', 'table.props_list.nbg tr.js-prop-replace', 'span.js-prop-title', 'span.js-prop-value'),
+    ),
+)
+
+MOTOLAND = SiteAdapter(
+    name='motoland',
+    title='Motoland',
+    domain='motoland-shop.ru',
+    root_url='https://motoland-shop.ru/',
+    # URL товара: как минимум 4 сегмента после /catalog/, например
+    # /catalog/mototekhnika/mototsikly_1/enduro_1/mototsikl_motoland_250_enduro_gs_172fmm_5_pr250_/
+    product_url_pattern=r'/catalog(?:/[^/]+){4,}/?$',
+    catalog_parse_only=('catalog-block', 'element-count', 'module-pagination'),
+    catalog_count='span.element-count.font_18.bordered.button-rounded-x',
+    catalog_pagination='div.module-pagination a[href]',
+    catalog_container='div.catalog-block',
+    catalog_cards='div.grid-list__item',
+    card_fields=(
+        Group('div.catalog-block__info-title', required=True, fields=(
+            Field('link', 'a', attr='href', url=True, required=True),
+            Field('name', ['span', 'a']), # Если в заголовке нет span, берем текст ссылки
+        )),
+        Field('images', 'a.image-list__link img', attr='data-src', many=True, url=True),
+        Field('price', 'meta[itemprop="price"]', attr='content', default='N/A'),
+    ),
+    product_fields=(
+        Field('name', 'h1.font_24.switcher-title.js-popup-title.mb.mb--0', text='strip', default='Наименование не найдено'),
+        Field('images', 'div.detail-gallery-big.swipeignore.image-list__link img', attr='data-src', many=True, url=True),
+        Group('div.price__row', fields=(
+            Field('price', 'span.price__new-val.font_24', text='strip', default='N/A'),
+            Field('old_price', 'del.price__old-val.font_15.secondary-color', text='strip'),
+        )),
+        Field('description', 'div.content.content--max-width.js-detail-description', text='strip', default=''),
+        Pairs('characteristics', 'div.properties-group__items.js-offers-group__items-wrap.font_15 div.properties-group__item',
+              'span.properties-group__name', 'div.properties-group__value.color_dark'),
+    ),
+)
+
+SITES = [ROLLINGMOTO, MOTOLAND]
+SITES_BY_NAME = {site.name: site for site in SITES}
+
+def register(adapter):
+    SITES.append(adapter)
+    SITES_BY_NAME[adapter.name] = adapter
+
+def get_site(url):
+    """Returns the adapter of the shop the URL belongs to, or None."""
+    for site in SITES:
+        if site.matches(url):
+            return site
+    return None
+
+def site_name(url):
+    site = get_site(url)
+    return site.name if site is not None else 'other'
@@ -0,0 +1,45 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import price_history
+
+LINK = 'https://motoland-shop.ru/catalog/mototekhnika/mototsikly_1/enduro_1/mototsikl_test/'
+
+def catalog_card(price):
+    # Карточка каталога Motoland: old_price сайт не объявляет, парсер оставляет None
+    return {'link': LINK, 'site': 'motoland', 'name': 'Мотоцикл', 'price': price, 'old_price': None}
+
+def product_page(price, old_price):
+    return {'link': LINK, 'site': 'motoland', 'name': 'Мотоцикл', 'price': price, 'old_price': old_price,
+            'characteristics': {}}
+
+class AlternatingSourcesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = price_history.SQLitePriceStore(os.path.join(self.directory.name, 'prices.sqlite3'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_catalog_card_keeps_old_price_of_product_page(self):
+        self.assertEqual(self.store.record([product_page('99 900 ₽', '119 900 ₽')], 1), 1)
+        for observed_at in range(2, 8, 2):
+            self.assertEqual(self.store.record([catalog_card('99900')], observed_at), 0)
+            self.assertEqual(self.store.record([product_page('99 900 ₽', '119 900 ₽')], observed_at + 1), 0)
+        self.assertEqual(self.store.changes_since(0), [])
+        self.assertEqual(self.store.history(LINK)['old_price'], 119900)
+
+    def test_discount_end_on_product_page_is_recorded(self):
+        self.store.record([product_page('99 900 ₽', '119 900 ₽')], 1)
+        self.store.record([catalog_card('119900')], 2)
+        self.assertEqual(self.store.record([product_page('119 900 ₽', None)], 3), 1)
+        changes = self.store.changes_since(0)
+        self.assertEqual([(c['price'], c['old_price'], c['previousOldPrice']) for c in changes],
+                         [(119900, 119900, 119900), (119900, None, 119900)])
+
+if __name__ == '__main__':
+    unittest.main()
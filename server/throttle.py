@@ -0,0 +1,232 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+import metrics
+
+# Ограничение нагрузки на каждый сайт, общее для всех запросов процесса:
+# токен-бакет задает частоту запросов, AIMD-контроллер — число одновременных запросов.
+# Параллельность растет, пока задержка и ошибки в норме, и падает вдвое на 429/503,
+# ошибки соединения или заметный рост задержки.
+ENABLED = True
+HOST_RATE = 20.0 # Запросов в секунду к одному хосту
+HOST_BURST = 40 # Сколько запросов можно сделать подряд без ожидания
+INITIAL_CONCURRENCY = 4
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 20 # Не больше пула соединений к хосту (http_client.POOL_SIZE)
+LATENCY_TOLERANCE = 2.0 # Во сколько раз задержка может превысить базовую, прежде чем снижать параллельность
+BACKOFF_RATIO = 0.5
+BACKOFF_COOLDOWN = 1.0 # Максимум секунд между двумя снижениями: пачка 429 подряд — это одна перегрузка
+OVERLOAD_STATUSES = (429, 503)
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        """Holds back every request to the host, e.g. for Retry-After."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def try_acquire(self):
+        """Takes one token if available and returns 0; otherwise returns the
+        seconds to wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if now >= self._blocked_until and self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return max(self._blocked_until - now, (1 - self._tokens) / self.rate)
+
+    def acquire(self):
+        """Takes one token, sleeping until one is available. Returns the wait in seconds."""
+        waited = 0.0
+        while True:
+            delay = self.try_acquire()
+            if not delay: return waited
+            time.sleep(delay)
+            waited += delay
+
+class AdaptiveLimit:
+    """AIMD limit on concurrent requests to one host."""
+
+    def __init__(self, initial, minimum, maximum):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.baseline = None # Задержка без нагрузки: медленно растущий минимум наблюдений
+        self.smoothed = None # Сглаженная текущая задержка: одиночный медленный ответ не повод сокращать
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        self._async_waiters = [] # (цикл событий, future) ожидающих в asyncio-коде
+
+    def acquire(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            return self.in_flight >= int(self.limit) # Лимит выбран полностью: его есть смысл увеличивать
+
+    async def acquire_async(self):
+        """acquire() for asyncio code: waits for a free slot without blocking the loop."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return self.in_flight >= int(self.limit)
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            await future
+
+    def release(self, latency, overloaded, saturated):
+        with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                self._decrease()
+            elif latency is not None:
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    self.baseline += (latency - self.baseline) * 0.01
+                self.smoothed = latency if self.smoothed is None else self.smoothed + (latency - self.smoothed) * 0.2
+                if self.smoothed > self.baseline * LATENCY_TOLERANCE:
+                    self._decrease()
+                elif saturated:
+                    # Аддитивный рост: примерно +1 за каждые limit успешных запросов
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+            # Слот мог освободить поток: будим ожидающих в asyncio через их циклы событий
+            waiters, self._async_waiters = self._async_waiters, []
+            for loop, future in waiters:
+                try:
+                    loop.call_soon_threadsafe(_wake, future)
+                except RuntimeError:
+                    pass # Цикл событий уже закрыт
+
+    def backoff(self):
+        with self._condition:
+            self._decrease()
+
+    def _decrease(self):
+        now = time.monotonic()
+        # Ответы на запросы, отправленные до прошлого снижения, о новом лимите еще ничего не говорят:
+        # ждем примерно два времени ответа
+        cooldown = min(BACKOFF_COOLDOWN, 2 * self.smoothed) if self.smoothed else BACKOFF_COOLDOWN
+        if now - self._last_decrease < cooldown: return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * BACKOFF_RATIO)
+
+def _wake(future):
+    if not future.done(): future.set_result(None)
+
+class HostThrottle:
+    def __init__(self, host):
+        self.host = host
+        self.bucket = TokenBucket(HOST_RATE, HOST_BURST)
+        self.concurrency = AdaptiveLimit(INITIAL_CONCURRENCY, MIN_CONCURRENCY, MAX_CONCURRENCY)
+
+class RequestOutcome:
+    """Filled in by the caller inside throttle.request()."""
+
+    def __init__(self):
+        self.status = None
+        self.retry_after = None
+        self.latency = None # Время до заголовков ответа; если не задано, меряется весь запрос
+
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+def configure(enabled=None, rate=None, burst=None, initial=None, minimum=None, maximum=None):
+    """Changes the settings; hosts seen before start over with the new ones."""
+    global ENABLED, HOST_RATE, HOST_BURST, INITIAL_CONCURRENCY, MIN_CONCURRENCY, MAX_CONCURRENCY
+    with _hosts_lock:
+        if enabled is not None: ENABLED = enabled
+        if rate is not None: HOST_RATE = rate
+        if burst is not None: HOST_BURST = burst
+        if initial is not None: INITIAL_CONCURRENCY = initial
+        if minimum is not None: MIN_CONCURRENCY = minimum
+        if maximum is not None: MAX_CONCURRENCY = maximum
+        _hosts.clear()
+
+def for_host(host):
+    with _hosts_lock:
+        throttle = _hosts.get(host)
+        if throttle is None:
+            throttle = _hosts[host] = HostThrottle(host)
+        return throttle
+
+def wait_for_token(host):
+    """Takes a token for an extra attempt (used by the retry hook in http_client)."""
+    if not ENABLED or not host: return
+    for_host(host).bucket.acquire()
+
+def report_overload(host, retry_after=None):
+    """Called on every 429/503, including ones that urllib3 retries internally."""
+    if not ENABLED or not host: return
+    throttle = for_host(host)
+    metrics.count('http_throttled_total', host=host)
+    if retry_after:
+        throttle.bucket.pause(retry_after)
+    throttle.concurrency.backoff()
+
+@contextmanager
+def request(host):
+    """Holds a concurrency slot and a rate token of the host for one request.
+    Network errors and 429/503 in outcome.status shrink the concurrency limit.
+    """
+    outcome = RequestOutcome()
+    if not ENABLED or not host:
+        yield outcome
+        return
+    throttle = for_host(host)
+    saturated = throttle.concurrency.acquire()
+    overloaded = True # Исключение во время запроса тоже считается перегрузкой
+    latency = None
+    try:
+        throttle.bucket.acquire()
+        start = time.monotonic()
+        yield outcome
+        latency = outcome.latency if outcome.latency is not None else time.monotonic() - start
+        overloaded = outcome.status in OVERLOAD_STATUSES
+        if overloaded and outcome.retry_after:
+            throttle.bucket.pause(outcome.retry_after)
+    finally:
+        throttle.concurrency.release(latency, overloaded, saturated)
+        metrics.gauge('host_concurrency_limit', int(throttle.concurrency.limit), host=host)
+
+@asynccontextmanager
+async def request_async(host):
+    """request() for asyncio code (the ASGI app): the same per-host AIMD limit
+    and token bucket, awaited instead of blocking the thread.
+    """
+    outcome = RequestOutcome()
+    if not ENABLED or not host:
+        yield outcome
+        return
+    throttle = for_host(host)
+    saturated = await throttle.concurrency.acquire_async()
+    overloaded = True
+    latency = None
+    try:
+        while True:
+            delay = throttle.bucket.try_acquire()
+            if not delay: break
+            await asyncio.sleep(delay)
+        start = time.monotonic()
+        yield outcome
+        latency = outcome.latency if outcome.latency is not None else time.monotonic() - start
+        overloaded = outcome.status in OVERLOAD_STATUSES
+        if overloaded and outcome.retry_after:
+            throttle.bucket.pause(outcome.retry_after)
+    finally:
+        throttle.concurrency.release(latency, overloaded, saturated)
+        metrics.gauge('host_concurrency_limit', int(throttle.concurrency.limit), host=host)
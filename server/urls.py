@@ -0,0 +1,31 @@
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+_SLASHES_RE = re.compile(r'/{2,}')
+
+def normalize_url_slashes(url):
+    """Replaces multiple slashes with a single slash in the URL path,
+    preserving http:// or https://.
+    """
+    if '://' in url:
+        protocol, rest = url.split('://', 1)
+        # Split by the first slash after protocol to keep domain part separate
+        if '/' in rest:
+            domain, path = rest.split('/', 1)
+            # Remove redundant slashes in the path part and then strip any leading slashes
+            # Most URLs have no repeated slashes, so the regex is skipped for them
+            normalized_path = (_SLASHES_RE.sub('/', path) if '//' in path else path).lstrip('/')
+            return f"{protocol}://{domain}/{normalized_path}"
+        else:
+            return url # No path, nothing to normalize
+    else:
+        # If no protocol, just replace double slashes
+        return _SLASHES_RE.sub('/', url) if '//' in url else url
+
+def normalize_link(link):
+    """Key for deduplicating products: the same page under http/https, with
+    another host case, query string or without the trailing slash.
+    """
+    parts = urlsplit(normalize_url_slashes(link.strip()))
+    path = parts.path if parts.path.endswith('/') else parts.path + '/'
+    return urlunsplit(('https', parts.netloc.lower(), path, '', ''))